@@ -0,0 +1,70 @@
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+# usage: python benchmarkMemory.py [outputs] [src directory]
+# pass src directory of other checkout to compare memory used by its data model
+outputs_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+src_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, os.path.abspath(src_path))
+
+from CryptoInput import Input
+from CryptoOutput import Output
+from CryptoTransaction import Transaction
+try:
+    from CryptoOwnerTable import owner_table
+except ImportError:
+    # checkout without owner table
+    owner_table = None
+
+OWNERS = [f'{owner:064x}' for owner in range(100)]
+# outputs kept in blockchain state belong to owners added to owner table by connected blocks
+if owner_table is not None:
+    for owner_key in OWNERS:
+        owner_table.get_id(owner_key)
+
+
+def owner(idx: int) -> str:
+    # owners parsed from JSON are separate string objects
+    return (OWNERS[idx % len(OWNERS)] + ' ')[:-1]
+
+
+def transaction_id(idx: int) -> str:
+    value = f'{idx:032x}'
+    return f'{value[:8]}-{value[8:12]}-{value[12:16]}-{value[16:20]}-{value[20:]}'
+
+
+def measure(create) -> tuple[int, float]:
+    gc.collect()
+    tracemalloc.start()
+    begin = time.perf_counter()
+    objects = create()
+    duration = time.perf_counter() - begin
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return size, duration
+
+
+def create_outputs():
+    return [Output(owner(idx), idx) for idx in range(outputs_count)]
+
+
+def create_transactions():
+    # every transaction spends one input and has two outputs - receiver and change
+    return [
+        Transaction(transaction_id(idx), 1, 'ab' * 64,
+                    [Input(transaction_id(idx + outputs_count), owner(idx), 100)],
+                    [Output(owner(idx + 1), 90), Output(owner(idx), 9)], '')
+        for idx in range(outputs_count // 2)
+    ]
+
+
+print(f'src: {os.path.abspath(src_path)}')
+size, duration = measure(create_outputs)
+print(f'outputs:      {outputs_count:9d}, {size / 2 ** 20:8.1f} MB, {size / outputs_count:6.1f} B per output, {duration:.2f}s')
+size, duration = measure(create_transactions)
+transactions_count = outputs_count // 2
+print(f'transactions: {transactions_count:9d}, {size / 2 ** 20:8.1f} MB, {size / transactions_count:6.1f} B per transaction, {duration:.2f}s')
@@ -0,0 +1,45 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from CryptoBlock import Block
+from CryptoProofOfWork import ProofOfWorkEngine
+
+DURATION = 3  # seconds for every measurement
+
+block = Block('ab' * 32, {'transactions': None, 'message': 'benchmark'}, 'cd' * 32)
+
+
+def measure(try_nonce):
+    nonce = 0
+    begin = time.perf_counter()
+    while time.perf_counter() - begin < DURATION:
+        for _ in range(1000):
+            try_nonce(nonce)
+            nonce += 1
+    return nonce / (time.perf_counter() - begin)
+
+
+def measure_search(engine):
+    nonce = 0
+    begin = time.perf_counter()
+    while time.perf_counter() - begin < DURATION:
+        engine.search(range(nonce, nonce + 1000))
+        nonce += 1000
+    return nonce / (time.perf_counter() - begin)
+
+
+engine = ProofOfWorkEngine.from_block(block)
+
+# both implementations must accept exactly the same nonces
+for nonce in range(200000):
+    if block.verify_nonce(nonce) != engine.verify_nonce(nonce):
+        raise AssertionError(f'Results differ for nonce {nonce}')
+
+before = measure(block.verify_nonce)
+after = measure_search(engine)
+print(f'Block.verify_nonce:        {before:12.0f} hashes/sec')
+print(f'ProofOfWorkEngine.search:  {after:12.0f} hashes/sec')
+print(f'Speedup:                   {after / before:12.2f}x')
@@ -0,0 +1,228 @@
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from nacl.signing import SigningKey
+
+import CryptoBlock
+import CryptoBlockchainPool
+from CryptoBlock import Block
+from CryptoBlockStore import BlockStore
+from CryptoBlockchainPool import BlockchainPool
+from CryptoOutput import Output
+from CryptoTransaction import Transaction
+from CryptoTransactionPool import TransactionPool
+from CryptoUtxoIndex import UtxoIndex
+
+# usage: python checkBlockStore.py [blocks]
+# Checks block store recovery, snapshot restore, UTXO index after reorgs and
+# transaction pool limits on a generated blockchain with forks.
+blocks_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+# easy proof of work - blocks are generated, not mined by network
+CryptoBlock.target = 2 ** 252
+CryptoBlockchainPool.SNAPSHOT_INTERVAL = 50
+logger = logging.getLogger('checkBlockStore')
+failures = []
+
+
+class Signer:
+    '''
+    Key used to sign generated transactions, without keys file used by `KeyManager`.
+    '''
+
+    def __init__(self, seed: int) -> None:
+        self.__signing_key = SigningKey(bytes([seed]) * 32)
+        self.public_key = self.__signing_key.verify_key.encode().hex()
+
+    def sign(self, payload_bytes: bytes) -> str:
+        return self.__signing_key.sign(payload_bytes).signature.hex()
+
+
+def check(name: str, is_ok: bool) -> None:
+    print(f'{name}: {"ok" if is_ok else "FAILED"}')
+    if not is_ok:
+        failures.append(name)
+
+
+def mine(prev_hash: str | None, block_data: dict, miner: Signer) -> Block:
+    block = Block(prev_hash, block_data, miner.public_key)
+    nonce = 0
+    while not block.verify_nonce(nonce):
+        nonce += 1
+    block.set_nonce(nonce)
+    block.set_prev_hash_nonce(block.calculate_hash_prev_block_nonce())
+    return block
+
+
+def create_transaction(pool: BlockchainPool, sender: Signer, receiver: Signer, transaction_id: str) -> Transaction | None:
+    inputs = pool.get_blockchain().get_inputs(sender.public_key)
+    balance = sum(i.get_amount() for i in inputs)
+    amount = max(1, balance // 2)
+    fee = Transaction.calculate_transaction_fee(amount)
+    if balance <= amount + fee:
+        return None
+    outputs = [Output(receiver.public_key, amount), Output(sender.public_key, balance - amount - fee)]
+    transaction, _, is_valid = Transaction.create_transaction(
+        sender, logger, transaction_id, fee, inputs, outputs, 'check')
+    return transaction if is_valid else None
+
+
+def generate_blocks(pool: BlockchainPool, signers: list[Signer], count: int) -> list[Block]:
+    '''
+    Adds blocks with transactions to the pool, some of them on forks of recent blocks.
+    '''
+    rnd = random.Random(1)
+    genesis_block = mine(None, {'message': 'Initial block'}, signers[0])
+    pool.add_block(genesis_block)
+    blocks = [genesis_block]
+    for idx in range(count):
+        main_head_hash = pool.get_head_hash()
+        prev_hash = main_head_hash if rnd.random() < 0.75 else rnd.choice(blocks[-8:]).get_block_hash()
+        transaction = create_transaction(pool, rnd.choice(signers), rnd.choice(signers), f'check-{idx}')
+        transactions = [transaction.to_json()] if transaction is not None and prev_hash == main_head_hash else None
+        # side branches are mined by another key - its owner buckets appear and disappear on reorgs
+        miner = rnd.choice(signers[:-1]) if prev_hash == main_head_hash else signers[-1]
+        block = mine(prev_hash, {'transactions': transactions, 'index': idx}, miner)
+        pool.add_block(block)
+        blocks.append(block)
+    return blocks
+
+
+def normalized_utxo_snapshot(utxo_index: UtxoIndex) -> str:
+    snapshot = utxo_index.to_snapshot()
+    snapshot['sources'] = {owner: sorted(sources) for owner, sources in snapshot['sources'].items()}
+    return json.dumps(snapshot, sort_keys=True)
+
+
+def chain_state(pool: BlockchainPool, signers: list[Signer]) -> tuple:
+    blockchain = pool.get_blockchain()
+    return ([block.get_block_hash() for block in blockchain.get_blocks()],
+            [sorted(json.dumps(i.to_json()) for i in blockchain.get_inputs(s.public_key)) for s in signers])
+
+
+def check_utxo_index(pool: BlockchainPool, name: str) -> None:
+    blockchain = pool.get_blockchain()
+    fresh_utxo_index = UtxoIndex()
+    fresh_utxo_index.sync(blockchain.get_blocks())
+    check(name, normalized_utxo_snapshot(blockchain.get_utxo_index()) == normalized_utxo_snapshot(fresh_utxo_index))
+
+
+def check_reorg(pool: BlockchainPool, signers: list[Signer]) -> None:
+    '''
+    Block mined by new key and paying to it is replaced by longer branch - key disappears from UTXO index.
+    '''
+    new_signer = Signer(len(signers) + 1)
+    head_hash = pool.get_head_hash()
+    transaction = create_transaction(pool, signers[0], new_signer, 'check-reorg')
+    pool.add_block(mine(head_hash, {'transactions': [transaction.to_json()]}, new_signer))
+    prev_hash = head_hash
+    for idx in range(2):
+        block = mine(prev_hash, {'transactions': None, 'reorg': idx}, signers[0])
+        pool.add_block(block)
+        prev_hash = block.get_block_hash()
+    check('reorg to longer branch', pool.get_head_hash() == prev_hash)
+    check_utxo_index(pool, 'utxo index after reorg equals index built from scratch')
+
+
+def check_block_store(path: str, signers: list[Signer]) -> None:
+    block_store = BlockStore(path, logger)
+    pool = BlockchainPool.create_blockchain_pool([], logger, block_store)
+    blocks = generate_blocks(pool, signers, blocks_count)
+    check_utxo_index(pool, 'utxo index after reorgs equals index built from scratch')
+    check_reorg(pool, signers)
+    expected_state = chain_state(pool, signers)
+    block_store.close()
+
+    block_store = BlockStore(path, logger)
+    restored_pool = BlockchainPool.create_blockchain_pool([], logger, block_store)
+    check('restore from snapshot and replayed blocks',
+          block_store.count() == len(blocks) + 3 and chain_state(restored_pool, signers) == expected_state)
+    check_utxo_index(restored_pool, 'utxo index restored from snapshot')
+    # reorg of blocks restored from snapshot uses restored undo records
+    prev_hash = restored_pool.get_blockchain().get_blocks()[-4].get_block_hash()
+    for idx in range(5):
+        block = mine(prev_hash, {'transactions': None, 'fork': idx}, signers[0])
+        restored_pool.add_block(block)
+        prev_hash = block.get_block_hash()
+    check('reorg after restore', restored_pool.get_head_hash() == prev_hash)
+    check_utxo_index(restored_pool, 'utxo index after reorg of restored blocks')
+    stored_count = block_store.count()
+    block_store.close()
+
+    segment_path = os.path.join(path, 'blk00000.dat')
+    # crash in the middle of writing the last record
+    with open(segment_path, 'r+b') as f:
+        f.truncate(os.path.getsize(segment_path) - 10)
+    block_store = BlockStore(path, logger)
+    check('truncated record is dropped', block_store.count() == stored_count - 1)
+    last_hash = block_store.get_block_hashes()[-1]
+    check('blocks before truncated record are readable', block_store.get(last_hash).get_block_hash() == last_hash)
+    block_store.close()
+
+    # damaged byte in the last record
+    with open(segment_path, 'r+b') as f:
+        f.seek(os.path.getsize(segment_path) - 2)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xff]))
+    block_store = BlockStore(path, logger)
+    check('record with wrong checksum is dropped', block_store.count() == stored_count - 2)
+    block_store.close()
+
+    # records written to segment but missing in index
+    index_path = os.path.join(path, 'index.dat')
+    with open(index_path, 'r+b') as f:
+        f.truncate(os.path.getsize(index_path) // 2)
+    block_store = BlockStore(path, logger)
+    check('records missing in index are recovered', block_store.count() == stored_count - 2)
+    pool = BlockchainPool.create_blockchain_pool([], logger, block_store)
+    check_utxo_index(pool, 'utxo index after recovery')
+    block_store.close()
+
+
+def check_transaction_pool(signers: list[Signer]) -> None:
+    pool = BlockchainPool(None, logger)
+    generate_blocks(pool, signers, 20)
+    transactions = []
+    for idx, sender in enumerate(signers):
+        transaction = create_transaction(pool, sender, signers[0], f'pool-{idx}')
+        if transaction is not None:
+            transactions.append(transaction)
+    transactions.sort(key=lambda t: t.get_transaction_fee() / len(t.get_bytes()))
+    sizes = [len(t.get_bytes()) for t in transactions]
+
+    # room for all transactions except the cheapest one
+    transaction_pool = TransactionPool(max_size=sum(sizes) - 1)
+    for transaction in transactions:
+        transaction_pool.add_transaction(transaction)
+    pending_ids = {t.get_transaction_id() for t in transaction_pool.get_transactions(set())}
+    check('cheapest transaction is evicted from full pool',
+          pending_ids == {t.get_transaction_id() for t in transactions[1:]} and transaction_pool.get_size() == sum(sizes[1:]))
+
+    transaction_pool = TransactionPool(expiry=0.1)
+    transaction_pool.add_transaction(transactions[0])
+    time.sleep(0.2)
+    transaction_pool.add_transaction(transactions[1])
+    check('expired transaction is dropped', transaction_pool.get_transaction(transactions[0].get_transaction_id()) is None
+          and transaction_pool.count() == 1)
+
+
+signers = [Signer(seed) for seed in range(1, 6)]
+path = tempfile.mkdtemp(prefix='simplecoin-')
+try:
+    check_block_store(path, signers)
+finally:
+    shutil.rmtree(path, ignore_errors=True)
+check_transaction_pool(signers)
+if failures:
+    print(f'{len(failures)} checks failed')
+    sys.exit(1)
+print('all checks passed')
@@ -0,0 +1,30 @@
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from CryptoBlock import Block
+from CryptoBlockchain import BlockChain
+
+# usage: python validateBlockchain.py [blockchain.json] [workers]
+filename = sys.argv[1] if len(sys.argv) > 1 else 'blockchain.json'
+workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count()
+
+blocks = Block.load_blocks(filename)
+if blocks is None:
+    print(f'Could not load blocks from {filename}')
+    sys.exit(1)
+
+for workers_count in sorted({1, workers}):
+    begin = time.perf_counter()
+    try:
+        # skip "Block added successfully" printed for every block
+        with contextlib.redirect_stdout(io.StringIO()):
+            BlockChain.create_blockchain(blocks, workers_count)
+        result = 'valid'
+    except ValueError as err:
+        result = f'invalid - {err}'
+    print(f'workers: {workers_count:3d}, blocks: {len(blocks)}, {time.perf_counter() - begin:.2f}s, {result}')
@@ -1,5 +1,6 @@
-from CryptoUtils import get_order_directory_recursively
+from CryptoUtils import get_order_directory_recursively, to_hashed_bytes, LEGACY_REPR
 from CryptoTransactionPool import Transaction
+from CryptoOwnerTable import owner_table
 import hashlib
 import json
 
@@ -11,6 +12,7 @@ class Block:
     '''
     Blockchain node class.
     '''
+    __slots__ = ('__header', '__data', '__transactions', '__bytes', '__hash', '__pow_bytes')
 
     # Header structure
     # ------------------
@@ -20,8 +22,14 @@ class Block:
     #   'hash_prev_nonce' : <str>
     #   'miner_pub_key'   : <str>
     # }
-    __header: dict = None
-    __data: dict = None
+    __header: dict
+    __data: dict
+    # transactions parsed from block data on first use - block data does not change
+    __transactions: tuple[Transaction, ...] | None
+    # serialized block, its hash and serialized proof of work data - calculated on first use, dropped when header changes
+    __bytes: bytes | None
+    __hash: str | None
+    __pow_bytes: bytes | None
 
     @staticmethod
     def load(candidate_block_object: dict):
@@ -61,6 +69,10 @@ class Block:
             'miner_pub_key': miner_pub_key
         }
         self.__data = block_data
+        self.__transactions = None
+        self.__bytes = None
+        self.__hash = None
+        self.__pow_bytes = None
 
     def get_block_hash(self):
         '''
@@ -68,9 +80,17 @@ class Block:
 
         :returns: Calculated block hash
         '''
-        block_json_bytes = str(self.to_json()).encode('utf-8')
-        block_hash = hashlib.sha256(block_json_bytes).hexdigest()
-        return block_hash
+        if self.__hash is None:
+            self.__hash = hashlib.sha256(self.get_bytes()).hexdigest()
+        return self.__hash
+
+    def get_bytes(self) -> bytes:
+        '''
+        Returns serialized block - the data block hash is calculated from.
+        '''
+        if self.__bytes is None:
+            self.__bytes = to_hashed_bytes(self.to_json(), LEGACY_REPR)
+        return self.__bytes
 
     def verify_nonce(self, nonce: int):
         '''
@@ -82,14 +102,19 @@ class Block:
         :returns: True if provided nonce value is valid, otherwise False.
         '''
 
-        pow_obj = self.get_pow_data()
         # find hash value for header
-        hash_result = hashlib.sha256(str(pow_obj).encode('utf-8') +
+        hash_result = hashlib.sha256(self.get_pow_bytes() +
                                      str(nonce).encode('utf-8')).hexdigest()
         # check if it's valid (lesser than target)
         is_nonce_valid = int(hash_result, 16) < target
         return is_nonce_valid
 
+    def get_work(self) -> int:
+        '''
+        Returns expected number of hashes needed to find nonce of the block.
+        '''
+        return 2 ** 256 // target
+
     def calculate_hash_prev_block_nonce(self):
         nonce = self.__header['nonce']
         prev_block_hash = self.get_prev_hash()
@@ -109,6 +134,14 @@ class Block:
             }
         })
 
+    def get_pow_bytes(self) -> bytes:
+        '''
+        Returns serialized proof of work data - nonce is appended to it before hashing.
+        '''
+        if self.__pow_bytes is None:
+            self.__pow_bytes = to_hashed_bytes(self.get_pow_data(), LEGACY_REPR)
+        return self.__pow_bytes
+
     def get_prev_hash(self):
         return self.__header['prev_block_hash']
 
@@ -151,29 +184,50 @@ class Block:
         })
         return block_object
 
-    def get_transactions(self) -> list[Transaction]:
+    def get_transactions(self) -> tuple[Transaction, ...]:
+        '''
+        Returns valid transactions of the block.
+        Transactions are parsed once and the same objects are returned on every call.
+        '''
+        if self.__transactions is None:
+            self.__transactions = self.__parse_transactions()
+        return self.__transactions
+
+    def __parse_transactions(self) -> tuple[Transaction, ...]:
         if self.__data == None:
-            return []
+            return ()
         if 'transactions' not in self.__data:
-            return []
+            return ()
         if self.__data['transactions'] is None:
-            return []
+            return ()
         transactions = []
         for transaction_dict in self.__data['transactions']:
             _, valid = Transaction.is_valid(transaction_dict)
             if valid:
                 transaction = Transaction.create_from_json(transaction_dict)
                 transactions.append(transaction)
-        return transactions
+        return tuple(transactions)
 
     def set_nonce(self, nonce: str) -> None:
         self.__header['nonce'] = nonce
+        self.__bytes = None
+        self.__hash = None
+        self.__pow_bytes = None
 
     def set_prev_hash_nonce(self, prev_hash_nonce: str) -> None:
         self.__header['hash_prev_nonce'] = prev_hash_nonce
+        self.__bytes = None
+        self.__hash = None
+        self.__pow_bytes = None
 
     def get_miner(self) -> str:
         return self.__header['miner_pub_key']
+
+    def get_miner_id(self) -> int | None:
+        '''
+        Returns owner table id of miner or None if miner is not in owner table.
+        '''
+        return owner_table.find_id(self.__header['miner_pub_key'])
     
     @staticmethod
     def load_blocks(filename: str):
@@ -0,0 +1,325 @@
+from CryptoBlock import Block
+from logging import Logger
+from threading import Lock
+from typing import Iterator
+import json
+import os
+import struct
+import time
+import zlib
+
+# new segment file is started when current one exceeds this size (bytes)
+SEGMENT_SIZE = 16 * 1024 * 1024
+# appended blocks are flushed to disk (fsync) after this many blocks...
+FSYNC_BLOCKS = 32
+# ...or when this time passed since the last fsync (seconds)
+FSYNC_INTERVAL = 1.0
+
+INDEX_FILE_NAME = 'index.dat'
+SNAPSHOT_FILE_NAME = 'snapshot.json'
+# snapshots of other version are ignored - blockchain state is rebuilt from stored blocks
+SNAPSHOT_VERSION = 4
+# record in segment: block hash, length of data, crc32 of data - followed by block json
+RECORD_HEADER = struct.Struct('>32sII')
+# entry in index: block hash, segment number, offset of record in segment
+INDEX_ENTRY = struct.Struct('>32sII')
+
+
+class StoredBlock:
+    '''
+    Block restored from snapshot - body is read from block store and parsed on first use.
+
+    Hash and previous block hash are known from snapshot, so blockchain tree can
+    be restored and walked without reading stored blocks. Other methods are
+    forwarded to the loaded block.
+    '''
+    __slots__ = ('__block_store', '__block_hash', '__prev_hash', '__block')
+
+    def __init__(self, block_store, block_hash: str, prev_hash: str | None) -> None:
+        self.__block_store = block_store
+        self.__block_hash = block_hash
+        self.__prev_hash = prev_hash
+        self.__block = None
+
+    def get_block_hash(self) -> str:
+        return self.__block_hash
+
+    def get_prev_hash(self) -> str | None:
+        return self.__prev_hash
+
+    def __getattr__(self, name: str):
+        block = self.__block
+        if block is None:
+            block = self.__block_store.get(self.__block_hash)
+            self.__block = block
+        return getattr(block, name)
+
+
+class BlockStore:
+    '''
+    Append-only block storage.
+
+    Blocks are appended to segment files and never rewritten, so the cost of
+    a write does not depend on chain size. Index file maps block hash to
+    (segment, offset) of its record. Files are fsynced in batches - after
+    crash, records not fully written are detected by length and checksum
+    and dropped, index is restored from segments.
+    '''
+    __path: str = None
+    __logger: Logger = None
+    # block hash -> (segment number, offset in segment)
+    __index: dict[str, tuple[int, int]] = None
+    # block hashes in order of appending
+    __hashes: list[str] = None
+    __segment: int = None
+    __segment_file = None
+    __index_file = None
+    __pending_blocks: int = None
+    __last_sync: float = None
+    __lock: Lock = None
+
+    def __init__(self, path: str, logger: Logger) -> None:
+        self.__path = path
+        self.__logger = logger
+        self.__index = {}
+        self.__hashes = []
+        self.__pending_blocks = 0
+        self.__last_sync = time.monotonic()
+        self.__lock = Lock()
+        os.makedirs(path, exist_ok=True)
+        self.__recover()
+        self.__segment_file = open(self.__segment_path(self.__segment), 'ab')
+        self.__index_file = open(os.path.join(path, INDEX_FILE_NAME), 'ab')
+
+    def count(self) -> int:
+        return len(self.__hashes)
+
+    def contains(self, block_hash: str) -> bool:
+        return block_hash in self.__index
+
+    def get_block_hashes(self) -> list[str]:
+        '''
+        Returns hashes of stored blocks in order of appending.
+        '''
+        with self.__lock:
+            return list(self.__hashes)
+
+    def append(self, block: Block, block_hash: str | None = None) -> bool:
+        '''
+        Appends block to the store.
+
+        :returns: False if block is already stored, otherwise True.
+        '''
+        if block_hash is None:
+            block_hash = block.get_block_hash()
+        data = json.dumps(block.to_json()).encode('utf-8')
+        with self.__lock:
+            if block_hash in self.__index:
+                return False
+            if self.__segment_file.tell() >= SEGMENT_SIZE:
+                self.__start_segment()
+            offset = self.__segment_file.tell()
+            raw_hash = bytes.fromhex(block_hash)
+            self.__segment_file.write(RECORD_HEADER.pack(raw_hash, len(data), zlib.crc32(data)))
+            self.__segment_file.write(data)
+            self.__index_file.write(INDEX_ENTRY.pack(raw_hash, self.__segment, offset))
+            # make record visible for readers, fsync is done in batches
+            self.__segment_file.flush()
+            self.__index_file.flush()
+            self.__index[block_hash] = (self.__segment, offset)
+            self.__hashes.append(block_hash)
+            self.__pending_blocks += 1
+            if self.__pending_blocks >= FSYNC_BLOCKS or time.monotonic() - self.__last_sync >= FSYNC_INTERVAL:
+                self.__sync()
+        return True
+
+    def get_stored_block(self, block_hash: str, prev_hash: str | None) -> StoredBlock:
+        '''
+        Returns block which is read from the store when it is used for the first time.
+        '''
+        return StoredBlock(self, block_hash, prev_hash)
+
+    def get(self, block_hash: str) -> Block | None:
+        location = self.__index.get(block_hash)
+        if location is None:
+            return None
+        segment, offset = location
+        with open(self.__segment_path(segment), 'rb') as f:
+            f.seek(offset)
+            _, length, _ = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+            return Block.load(json.loads(f.read(length)))
+
+    def iter_blocks(self, start: int = 0) -> Iterator[Block]:
+        '''
+        Iterates over stored blocks in order of appending - parent blocks before their children.
+
+        :param start: Number of stored blocks skipped - they are not read.
+        '''
+        with self.__lock:
+            locations = [self.__index[block_hash] for block_hash in self.__hashes[start:]]
+        segment_data = None
+        segment_number = None
+        for segment, offset in locations:
+            if segment != segment_number:
+                with open(self.__segment_path(segment), 'rb') as f:
+                    segment_data = f.read()
+                segment_number = segment
+            _, length, _ = RECORD_HEADER.unpack_from(segment_data, offset)
+            data_offset = offset + RECORD_HEADER.size
+            yield Block.load(json.loads(segment_data[data_offset:data_offset + length]))
+
+    def save_snapshot(self, state: dict, block_count: int) -> None:
+        '''
+        Saves state derived from the first `block_count` appended blocks.
+        Snapshot file is replaced atomically, blocks it depends on are flushed to disk first.
+        '''
+        with self.__lock:
+            self.__sync()
+            snapshot = {
+                'version': SNAPSHOT_VERSION,
+                'block_count': block_count,
+                'last_block_hash': self.__hashes[block_count - 1] if block_count > 0 else None,
+                'state': state
+            }
+        snapshot_path = os.path.join(self.__path, SNAPSHOT_FILE_NAME)
+        temporary_path = snapshot_path + '.tmp'
+        with open(temporary_path, 'w') as f:
+            json.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, snapshot_path)
+
+    def load_snapshot(self) -> tuple[int, dict] | None:
+        '''
+        Loads the latest snapshot.
+
+        :returns: Tuple of number of blocks covered by snapshot and saved state, or None if there is no usable snapshot.
+        '''
+        snapshot_path = os.path.join(self.__path, SNAPSHOT_FILE_NAME)
+        try:
+            with open(snapshot_path, 'r') as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            self.__logger.warning('Block store snapshot is broken - it will be ignored')
+            return None
+        block_count = snapshot.get('block_count', 0)
+        if snapshot.get('version') != SNAPSHOT_VERSION or block_count == 0 or block_count > len(self.__hashes) or \
+                self.__hashes[block_count - 1] != snapshot.get('last_block_hash'):
+            self.__logger.warning('Block store snapshot does not match stored blocks - it will be ignored')
+            return None
+        return block_count, snapshot['state']
+
+    def sync(self) -> None:
+        '''
+        Flushes all appended blocks to disk.
+        '''
+        with self.__lock:
+            self.__sync()
+
+    def close(self) -> None:
+        with self.__lock:
+            self.__sync()
+            self.__segment_file.close()
+            self.__index_file.close()
+
+    def __sync(self) -> None:
+        # segments first - index entry can not point to record which is not on disk
+        os.fsync(self.__segment_file.fileno())
+        os.fsync(self.__index_file.fileno())
+        self.__pending_blocks = 0
+        self.__last_sync = time.monotonic()
+
+    def __start_segment(self) -> None:
+        self.__sync()
+        self.__segment_file.close()
+        self.__segment += 1
+        self.__segment_file = open(self.__segment_path(self.__segment), 'ab')
+
+    def __segment_path(self, segment: int) -> str:
+        return os.path.join(self.__path, f'blk{segment:05d}.dat')
+
+    def __recover(self) -> None:
+        '''
+        Loads index and brings it in line with segments after unclean shutdown.
+        '''
+        index_path = os.path.join(self.__path, INDEX_FILE_NAME)
+        index_data = b''
+        if os.path.exists(index_path):
+            with open(index_path, 'rb') as f:
+                index_data = f.read()
+        entries = [INDEX_ENTRY.unpack_from(index_data, position)
+                   for position in range(0, len(index_data) - INDEX_ENTRY.size + 1, INDEX_ENTRY.size)]
+        # drop index entries pointing to records lost in crash
+        while len(entries) > 0 and self.__read_record_end(entries[-1][1], entries[-1][2]) is None:
+            entries.pop()
+
+        if len(entries) > 0:
+            self.__segment, offset = entries[-1][1], entries[-1][2]
+            offset = self.__read_record_end(self.__segment, offset)
+        else:
+            self.__segment, offset = 0, 0
+        # pick up records written to segments but missing in index
+        recovered = 0
+        while True:
+            end = self.__read_record_end(self.__segment, offset)
+            if end is None:
+                if os.path.exists(self.__segment_path(self.__segment + 1)) and self.__is_segment_end(self.__segment, offset):
+                    self.__segment, offset = self.__segment + 1, 0
+                    continue
+                break
+            with open(self.__segment_path(self.__segment), 'rb') as f:
+                f.seek(offset)
+                raw_hash = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))[0]
+            entries.append((raw_hash, self.__segment, offset))
+            recovered += 1
+            offset = end
+        self.__truncate(self.__segment, offset)
+
+        for raw_hash, segment, offset in entries:
+            block_hash = raw_hash.hex()
+            self.__index[block_hash] = (segment, offset)
+            self.__hashes.append(block_hash)
+        if len(entries) * INDEX_ENTRY.size != len(index_data) or recovered > 0:
+            with open(index_path, 'wb') as f:
+                f.write(b''.join(INDEX_ENTRY.pack(*entry) for entry in entries))
+                os.fsync(f.fileno())
+        if recovered > 0:
+            self.__logger.warning(f'Recovered {recovered} blocks missing in block store index')
+        self.__logger.info(f'Block store opened with {len(entries)} blocks')
+
+    def __read_record_end(self, segment: int, offset: int) -> int | None:
+        '''
+        Returns offset after complete record or None if there is no valid record at offset.
+        '''
+        path = self.__segment_path(segment)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return None
+            _, length, checksum = RECORD_HEADER.unpack(header)
+            data = f.read(length)
+        if len(data) < length or zlib.crc32(data) != checksum:
+            return None
+        return offset + RECORD_HEADER.size + length
+
+    def __is_segment_end(self, segment: int, offset: int) -> bool:
+        return os.path.getsize(self.__segment_path(segment)) == offset
+
+    def __truncate(self, segment: int, offset: int) -> None:
+        '''
+        Removes partially written record at the end of the store.
+        '''
+        path = self.__segment_path(segment)
+        if os.path.exists(path) and os.path.getsize(path) > offset:
+            self.__logger.warning(f'Dropping partially written data in block store segment {segment}')
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+        next_segment = segment + 1
+        while os.path.exists(self.__segment_path(next_segment)):
+            os.remove(self.__segment_path(next_segment))
+            next_segment += 1
@@ -0,0 +1,126 @@
+from CryptoBlockchain import BlockChain
+from CryptoTransaction import Transaction
+from logging import Logger
+
+MAX_BLOCK_TRANSACTIONS = 100
+# size of serialized block transactions in bytes
+MAX_BLOCK_SIZE = 100000
+# how many pending transactions are considered for one block - some of them can be skipped
+MAX_TEMPLATE_CANDIDATES = 4 * MAX_BLOCK_TRANSACTIONS
+
+
+class BlockTemplate:
+    '''
+    Transactions selected for the next candidate block.
+    '''
+    __transactions: list[Transaction] = None
+    __rejected_transactions: list[Transaction] = None
+    __is_full: bool = None
+
+    def __init__(self, transactions: list[Transaction], rejected_transactions: list[Transaction], is_full: bool) -> None:
+        self.__transactions = transactions
+        self.__rejected_transactions = rejected_transactions
+        self.__is_full = is_full
+
+    def get_transactions(self) -> list[Transaction]:
+        return self.__transactions
+
+    def get_rejected_transactions(self) -> list[Transaction]:
+        '''
+        Returns candidates which can never be valid - they can be removed from transaction pool.
+
+        Candidates with unavailable inputs are not rejected, their inputs can be
+        connected by next block or released by blockchain reorganization.
+        '''
+        return self.__rejected_transactions
+
+    def is_full(self) -> bool:
+        return self.__is_full
+
+    def to_block_data(self) -> dict:
+        if len(self.__transactions) == 0:
+            return {'transactions': None}
+        return {'transactions': [transaction.to_json() for transaction in self.__transactions]}
+
+
+class BlockTemplateBuilder:
+    '''
+    Packs valid and non-conflicting transactions into a block template.
+    '''
+    __max_transactions: int = None
+    __max_size: int = None
+    __logger: Logger = None
+
+    def __init__(self, logger: Logger, max_transactions: int = MAX_BLOCK_TRANSACTIONS, max_size: int = MAX_BLOCK_SIZE) -> None:
+        self.__logger = logger
+        self.__max_transactions = max_transactions
+        self.__max_size = max_size
+
+    def build(self, blockchain: BlockChain, candidates: list[Transaction]) -> BlockTemplate:
+        '''
+        Selects transactions in candidates order (highest fee first) until count or size limit is reached.
+
+        Transaction is rejected when it is not consistent. It is skipped for this
+        template when its inputs are not available in main blockchain or when it
+        uses inputs already used by transaction selected before.
+        '''
+        transactions = []
+        rejected_transactions = []
+        selected_ids = set()
+        # outpoints of outputs used by selected transactions
+        used_inputs = set()
+        # owner -> number of used block mining prices
+        used_block_prices = {}
+        # owner -> number of available block mining prices
+        available_block_prices = {}
+        size = 0
+        is_full = False
+        # check all signatures in parallel up front - validation below hits signatures cache
+        Transaction.verify_signatures(candidates)
+
+        for transaction in candidates:
+            if len(transactions) >= self.__max_transactions:
+                is_full = True
+                break
+            if transaction.get_transaction_id() in selected_ids:
+                continue
+
+            message, is_consistent = transaction.is_consistent()
+            if not is_consistent:
+                self.__logger.info(f'Transaction {transaction.get_transaction_id()} rejected from block template: {message}')
+                rejected_transactions.append(transaction)
+                continue
+            unavailable_input = blockchain.get_utxo_index().find_unavailable_input(transaction.get_inputs())
+            if unavailable_input is not None:
+                self.__logger.info(f'Transaction {transaction.get_transaction_id()} skipped in block template: '
+                                   f'input {unavailable_input.to_json()} is not available')
+                continue
+
+            sources = [blockchain.find_input(input) for input in transaction.get_inputs() if not input.is_block_price()]
+            # output can be spent by block connected after validation
+            if any(source is None for source in sources):
+                continue
+            transaction_inputs = set(source.get_outpoint() for source in sources)
+            transaction_block_prices = len(transaction.get_inputs()) - len(sources)
+            if not used_inputs.isdisjoint(transaction_inputs):
+                continue
+            sender = transaction.get_sender()
+            if transaction_block_prices > 0:
+                if sender not in available_block_prices:
+                    available_block_prices[sender] = blockchain.get_utxo_index().get_block_prices_count(sender)
+                if used_block_prices.get(sender, 0) + transaction_block_prices > available_block_prices[sender]:
+                    continue
+
+            transaction_size = len(transaction.get_bytes())
+            if size + transaction_size > self.__max_size:
+                is_full = True
+                continue
+
+            transactions.append(transaction)
+            selected_ids.add(transaction.get_transaction_id())
+            used_inputs.update(transaction_inputs)
+            used_block_prices[sender] = used_block_prices.get(sender, 0) + transaction_block_prices
+            size += transaction_size
+
+        is_full = is_full or len(transactions) >= self.__max_transactions
+        return BlockTemplate(transactions, rejected_transactions, is_full)
@@ -1,15 +1,65 @@
 from CryptoBlock import Block
 from CryptoTransaction import Transaction
-from CryptoInput import Input, BLOCK_PRICE_ID
+from CryptoInput import Input
+from CryptoUtxoIndex import UtxoIndex
+from CryptoOwnerTable import owner_table
+from concurrent.futures import ProcessPoolExecutor
 import json
+import math
+import multiprocessing
 from logging import Logger
+from typing import Iterator
 
 FILE_NAME = "blockchain.json"
-BLOCK_PRICE_AMOUNT = 5
+# smaller chains are verified in calling process
+MIN_PARALLEL_BLOCKS = 64
+
+# blocks verified by worker processes - inherited from parent process (fork)
+_blocks_to_verify: list[Block] = None
+
+
+def _verify_block(block: Block) -> tuple[bool, str, Exception | None]:
+    block_hash = block.get_block_hash()
+    try:
+        return block.verify_block(), block_hash, None
+    except Exception as err:
+        # raised when the block is reached in chain order - like in sequential validation
+        return False, block_hash, err
+
+
+def _w_verify_blocks(start: int, end: int) -> list[tuple[bool, str, Exception | None]]:
+    return [_verify_block(block) for block in _blocks_to_verify[start:end]]
+
+
+def verify_blocks(blocks: list[Block], workers: int) -> list[tuple[bool, str, Exception | None]]:
+    '''
+    Runs checks of single blocks (proof of work, hash_prev_nonce) and calculates
+    block hashes in worker processes. These checks do not depend on other blocks.
+
+    :returns: (is block valid, block hash, error raised by check) for every block, in blocks order.
+    '''
+    global _blocks_to_verify
+    if workers <= 1 or len(blocks) < MIN_PARALLEL_BLOCKS or 'fork' not in multiprocessing.get_all_start_methods():
+        return [_verify_block(block) for block in blocks]
+
+    # a few chunks per worker keep all workers busy until the end
+    chunk_size = math.ceil(len(blocks) / (workers * 4))
+    _blocks_to_verify = blocks
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as executor:
+            futures = [executor.submit(_w_verify_blocks, start, min(start + chunk_size, len(blocks)))
+                       for start in range(0, len(blocks), chunk_size)]
+            results = []
+            for future in futures:
+                results.extend(future.result())
+            return results
+    finally:
+        _blocks_to_verify = None
 
 
 class BlockChain:
     _blocks: list[Block] = None
+    _utxo_index: UtxoIndex = None
 
     def __init__(self, generic_block: Block | None):
         '''
@@ -25,6 +75,18 @@ class BlockChain:
 
     def add_block(self, new_block: Block):
         self._blocks.append(new_block)
+        if self._utxo_index is not None:
+            self._utxo_index.connect_block(new_block)
+
+    def pop_block(self) -> Block | None:
+        '''
+        Removes last block from blockchain.
+        '''
+        if len(self._blocks) == 0:
+            return None
+        if self._utxo_index is not None:
+            self._utxo_index.disconnect_block()
+        return self._blocks.pop()
 
     def to_json(self):
         blocks = []
@@ -48,12 +110,26 @@ class BlockChain:
             return False
         return True
 
-    def validate(self):
+    def validate(self, workers: int = 1):
         '''
         Validates whether blockchain is consistent or not.
 
+        :param workers: Number of processes checking blocks. With more than one,
+                        single blocks are checked in parallel and links between them afterwards.
+
         :returns: True if blockchain is valid, otherwise False.
         '''
+        if workers > 1 and len(self._blocks) > 1:
+            results = verify_blocks(self._blocks, workers)
+            for i in range(1, len(self._blocks)):
+                if results[i - 1][1] != self._blocks[i].get_prev_hash():
+                    return False
+                is_valid, _, error = results[i]
+                if error is not None:
+                    raise error
+                if not is_valid:
+                    return False
+            return True
         if len(self._blocks) == 1:  # single block in blockchain
             # just verify single block, there's no need to check with other block
             is_valid = self._blocks[0].verify_block()
@@ -80,9 +156,10 @@ class BlockChain:
             f.write(json.dumps(self.to_json()))
 
     @staticmethod
-    def create_blockchain(blockchain_list: list[Block]):
+    def create_blockchain(blockchain_list: list[Block], workers: int = 1):
         '''
         Creates blockchain class instance (like blockchain factory) from given list of blocks.
+        With more than one worker, blocks are checked in parallel processes (see `verify_blocks`).
 
         :throws: ValueError when:
         1) Provided blocks list is empty.
@@ -92,6 +169,8 @@ class BlockChain:
         if len(blockchain_list) == 0:
             raise ValueError(
                 "Provided blockchain is empty. Could not create blockchain.")
+        if workers > 1:
+            return BlockChain.__create_blockchain_parallel(blockchain_list, workers)
 
         generic_block_valid = blockchain_list[0].verify_block()
         if not generic_block_valid:
@@ -117,7 +196,35 @@ class BlockChain:
         return blockchain
 
     @staticmethod
-    def load_blockchain(filename: str):
+    def __create_blockchain_parallel(blockchain_list: list[Block], workers: int):
+        results = verify_blocks(blockchain_list, workers)
+        generic_block_valid, _, error = results[0]
+        if error is not None:
+            raise error
+        if not generic_block_valid:
+            raise ValueError("Generic block is invalid.")
+
+        blockchain = BlockChain(blockchain_list[0])
+
+        for i in range(1, len(blockchain_list)):
+            # previous hash of block has to match hash of previous block
+            is_valid_block = results[i - 1][1] == blockchain_list[i].get_prev_hash()
+            if is_valid_block:
+                is_valid_block, _, error = results[i]
+                if isinstance(error, ValueError):
+                    raise ValueError(f'Error for index {i} of the chain: {str(error)}')
+                if error is not None:
+                    raise error
+            if not is_valid_block:
+                raise ValueError(
+                    f'Error for index {i} of the chain: Found inconsistency in loaded blockchain.')
+
+            blockchain.add_block(blockchain_list[i])
+
+        return blockchain
+
+    @staticmethod
+    def load_blockchain(filename: str, workers: int = 1):
         '''
         Restores blockchain from provided file.
 
@@ -133,7 +240,7 @@ class BlockChain:
                 parsed_blockchain = json.loads(file_content)
 
                 blocks = Block.load_list(parsed_blockchain)
-                blockchain = BlockChain.create_blockchain(blocks)
+                blockchain = BlockChain.create_blockchain(blocks, workers)
 
                 return blockchain
         except FileNotFoundError:
@@ -142,16 +249,22 @@ class BlockChain:
             return None
 
     def get_transactions(self) -> list[Transaction]:
-        transactions = []
+        return list(self.iter_transactions())
+
+    def iter_transactions(self) -> Iterator[Transaction]:
+        '''
+        Iterates over transactions of all blocks without building list of them.
+        '''
         for block in self._blocks:
-            block_transactions = block.get_transactions()
-            transactions.extend(block_transactions)
-        return transactions
+            yield from block.get_transactions()
 
     def get_mined_blocks(self, owner: str) -> list[Block]:
         blocks = []
+        owner_id = owner_table.find_id(owner)
+        if owner_id is None:
+            return blocks
         for block in self._blocks:
-            if block.get_miner() != owner:
+            if block.get_miner_id() != owner_id:
                 continue
             blocks.append(block)
         return blocks
@@ -159,68 +272,34 @@ class BlockChain:
     def get_blocks(self) -> list[Block]:
         return self._blocks
     
+    def get_utxo_index(self) -> UtxoIndex:
+        '''
+        Returns unspent outputs index of the blockchain.
+        Index is built on first use and then updated with every added block.
+        '''
+        if self._utxo_index is None:
+            utxo_index = UtxoIndex()
+            utxo_index.sync(self._blocks)
+            self._utxo_index = utxo_index
+        return self._utxo_index
+
+    def set_utxo_index(self, utxo_index: UtxoIndex) -> None:
+        '''
+        Attaches index already synchronized with blockchain blocks.
+        '''
+        self._utxo_index = utxo_index
+
     def get_inputs(self, target_owner: str, logger: Logger | None = None) -> list[Input]:
         '''
         Return valid inputs for target owner.
         '''
-        all_transactions = self.get_transactions()
-        mined_blocks = len(self.get_mined_blocks(target_owner))
-        if logger:
-            logger.info(
-                f'mined_blocks: found {mined_blocks} mined_blocks')
-            logger.info(f'Found all_transactions: {len(all_transactions)}')
-        transaction_sources = {}
-        for transaction in all_transactions:
-            inputs = transaction.get_inputs()
-            outputs = transaction.get_outputs()
-            # remove from sources used outputs
-            for input in inputs:
-                source_transaction_id = input.get_transaction_id()
-                if input.get_owner() != target_owner:
-                    continue
-                if source_transaction_id == BLOCK_PRICE_ID:
-                    if mined_blocks > 0:
-                        mined_blocks -= 1
-                    else:
-                        if logger:
-                            logger.info(
-                                f'Input {input.to_json()} in transaction {transaction.to_json()} get block mining price which does not have')
-                    continue
-                elif source_transaction_id not in transaction_sources:
-                    if logger:
-                        logger.warning(
-                            f'In transaction_sources {transaction.to_json()} input {input.to_json()} has no valid previous source')
-                    continue
-                transaction_sources.pop(source_transaction_id)
-            # add to sources outputs from block
-            transaction_id = transaction.get_transaction_id()
-            for output in outputs:
-                owner = output.get_owner()
-                if owner != target_owner:
-                    continue
-                if logger:
-                    logger.info(
-                        f'Found output for owner {output.to_json()}')
-                if transaction_id in transaction_sources:
-                    if logger:
-                        logger.warning(
-                            f'In transaction_sources {transaction.to_json()} output {output.to_json()} try to add the same transaction - transaction id should be unique')
-                    continue
-                if logger:
-                    logger.info(
-                        f'CryptoInputs::get_inputs output: {output.to_json()} transaction_id: {transaction_id}')
-                new_input = Input.output_to_input(
-                    output, transaction_id, logger=logger)
-                transaction_sources[transaction_id] = new_input
-
-        if logger:
-            logger.info(f'After mined_blocks: {mined_blocks}')
-        inputs = list(transaction_sources.values())
-        for _ in range(mined_blocks):
-            new_input = Input(transaction_id=BLOCK_PRICE_ID,
-                              owner=target_owner, amount=BLOCK_PRICE_AMOUNT)
-            inputs.append(new_input)
-        return inputs
+        return self.get_utxo_index().get_inputs(target_owner, logger)
+
+    def find_input(self, input: Input) -> Input | None:
+        '''
+        Returns unspent output pointed by input or None if it is not available.
+        '''
+        return self.get_utxo_index().find_input(input)
 
     def is_valid_transaction_candidate(self, transaction: Transaction, logger: Logger | None = None) -> tuple[str, bool]:
         '''
@@ -232,19 +311,12 @@ class BlockChain:
                 logger.info(f'{message}')
             return message, False
     
-        sender = transaction.get_sender()
-        # Get available inputs
-        inputs = self.get_inputs(sender, logger)
-        # build str of json input to compare it later
-        inputs_json_str_list = [str(input.to_json()) for input in inputs]
-        
-        for transaction_input in transaction.get_inputs():
-            transaction_input_json_str = str(transaction_input.to_json())
-            if transaction_input_json_str not in inputs_json_str_list:
-                msg = f'{inputs_json_str_list} not in {inputs_json_str_list}'
-                if logger:
-                    logger.info(msg)
-                return msg, False
+        unavailable_input = self.get_utxo_index().find_unavailable_input(transaction.get_inputs())
+        if unavailable_input is not None:
+            msg = f'Input {unavailable_input.to_json()} is not available'
+            if logger:
+                logger.info(msg)
+            return msg, False
         return 'Ok', True
             
         
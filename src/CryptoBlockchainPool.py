@@ -2,38 +2,175 @@ from CryptoBlockchainTree import BlockchainTree
 from CryptoBlock import Block
 from logging import Logger
 from CryptoBlockchain import BlockChain
+from CryptoBlockStore import BlockStore
+from CryptoChainEvent import ChainEvent
+from typing import Callable
+from collections import OrderedDict
+import threading
+
+# snapshot of blockchain state is saved after this many new stored blocks
+SNAPSHOT_INTERVAL = 100
+# blocks waiting for their parent above this number are dropped - the oldest first
+MAX_ORPHAN_BLOCKS = 1000
 
 class BlockchainPool:
     
     __blockchain_tree: BlockchainTree = None
-    __orphan_blocks: list[Block] = []
+    # blocks with parent not present in blockchain tree yet, in order of receiving
+    __orphan_blocks: OrderedDict[str, Block] = None
+    # parent hash -> hashes of orphan blocks waiting for it
+    __orphans_by_prev_hash: dict[str, set[str]] = None
     __logger: Logger = None
+    # functions called with new head hash when main blockchain head changes
+    __head_listeners: list[Callable[[str], None]] = None
+    # functions called with hash of block which is missing to connect orphan blocks
+    __missing_block_listeners: list[Callable[[str], None]] = None
+    __lock: threading.RLock = None
+    # every block accepted by blockchain tree is appended to the store
+    __block_store: BlockStore = None
+    __blocks_since_snapshot: int = None
+    # serializes snapshot writes - snapshot is written without holding pool lock
+    __snapshot_lock: threading.Lock = None
     
-    def __init__(self, genesis_block: Block | None, logger: Logger) -> None:
-        self.__blockchain_tree = BlockchainTree(genesis_block, logger)
+    def __init__(self, genesis_block: Block | None, logger: Logger, block_store: BlockStore | None = None) -> None:
         self.__logger = logger
+        self.__orphan_blocks = OrderedDict()
+        self.__orphans_by_prev_hash = {}
+        self.__head_listeners = []
+        self.__missing_block_listeners = []
+        self.__lock = threading.RLock()
+        self.__block_store = block_store
+        self.__blocks_since_snapshot = 0
+        self.__snapshot_lock = threading.Lock()
+        self.__blockchain_tree = BlockchainTree(None, logger)
+        if genesis_block is not None:
+            self.__add_to_tree(genesis_block)
+
+    def add_head_listener(self, listener: Callable[[str], None]) -> None:
+        self.__head_listeners.append(listener)
+
+    def add_chain_listener(self, listener: Callable[[list[ChainEvent]], None]) -> None:
+        '''
+        Registers function called with ordered events of blocks connected to and disconnected from main blockchain.
+        '''
+        self.__blockchain_tree.add_chain_listener(listener)
+
+    def add_missing_block_listener(self, listener: Callable[[str], None]) -> None:
+        self.__missing_block_listeners.append(listener)
             
-    def add_block(self, block: Block) -> bool:
-        if self.__blockchain_tree is None:
-            self.__blockchain_tree = BlockchainTree(block, self.__logger)
-            return
-        success = self.__blockchain_tree.add_block(block)
-        if success:
-            # Find childs of added block among orphans
-            while True:
-                added_orphan_block = False 
-                for idx in range(len(self.__orphan_blocks)):
-                    orphan_block = self.__orphan_blocks[idx]
-                    if self.__blockchain_tree.add_block(orphan_block):
-                        self.__orphan_blocks.remove(orphan_block)
-                        self.__logger.info('Added new block from orphan list')
-                        added_orphan_block = True
-                        break
-                if not added_orphan_block:
-                    break
-        else:
-            self.__orphan_blocks.append(block)
+    def add_block(self, block: Block, is_verified: bool = False) -> tuple[str, bool]:
+        '''
+        Adds block to blockchain tree or keeps it as orphan until its parent is added.
+
+        :param is_verified: Block was already checked (proof of work, hash_prev_nonce) - it is not checked again.
+        '''
+        with self.__lock:
+            head_hash = self.get_head_hash()
+            message, is_added = self.__add_block(block, is_verified)
+            new_head_hash = self.get_head_hash()
+            if new_head_hash != head_hash:
+                for listener in self.__head_listeners:
+                    listener(new_head_hash)
+            is_snapshot_due = self.__block_store is not None and self.__blocks_since_snapshot >= SNAPSHOT_INTERVAL
+        if is_snapshot_due:
+            self.save_snapshot()
+        return message, is_added
+
+    def __add_block(self, block: Block, is_verified: bool = False) -> tuple[str, bool]:
+        block_hash = block.get_block_hash()
+        prev_hash = block.get_prev_hash()
+        # only genesis block starts empty tree - blocks received before it wait for their parents
+        is_genesis_block = prev_hash is None and self.__blockchain_tree.get_main_head_hash() is None
+        if not is_genesis_block and not self.__blockchain_tree.contains(prev_hash):
+            return self.__add_orphan(block, block_hash)
+        message, is_added = self.__add_to_tree(block, is_verified)
+        if is_added:
+            self.__connect_orphans(block_hash)
+        return message, is_added
+
+    def __add_orphan(self, block: Block, block_hash: str) -> tuple[str, bool]:
+        if block_hash in self.__orphan_blocks:
+            return 'Block is already waiting for its parent', False
+        prev_hash = block.get_prev_hash()
+        self.__orphan_blocks[block_hash] = block
+        self.__orphans_by_prev_hash.setdefault(prev_hash, set()).add(block_hash)
+        if len(self.__orphan_blocks) > MAX_ORPHAN_BLOCKS:
+            self.__remove_orphan(next(iter(self.__orphan_blocks)))
+        self.__logger.info(f'Block {block_hash} kept as orphan - waiting for parent {prev_hash}')
+
+        # parent can be an orphan too - the oldest missing ancestor is requested
+        missing_hash = prev_hash
+        while missing_hash in self.__orphan_blocks:
+            missing_hash = self.__orphan_blocks[missing_hash].get_prev_hash()
+        for listener in self.__missing_block_listeners:
+            listener(missing_hash)
+        return 'Block kept as orphan - waiting for parent', True
+
+    def __remove_orphan(self, block_hash: str) -> Block:
+        block = self.__orphan_blocks.pop(block_hash)
+        siblings = self.__orphans_by_prev_hash[block.get_prev_hash()]
+        siblings.discard(block_hash)
+        if len(siblings) == 0:
+            del self.__orphans_by_prev_hash[block.get_prev_hash()]
+        return block
+
+    def __connect_orphans(self, block_hash: str) -> None:
+        '''
+        Adds orphan blocks waiting for the block, then orphans waiting for them and so on.
+        '''
+        parent_hashes = [block_hash]
+        while len(parent_hashes) > 0:
+            child_hashes = self.__orphans_by_prev_hash.pop(parent_hashes.pop(), ())
+            for child_hash in child_hashes:
+                child_block = self.__orphan_blocks.pop(child_hash)
+                _, is_added = self.__add_to_tree(child_block)
+                if is_added:
+                    self.__logger.info('Added new block from orphan list')
+                    parent_hashes.append(child_hash)
             
+    def __add_to_tree(self, block: Block, is_verified: bool = False) -> tuple[str, bool]:
+        message, is_added = self.__blockchain_tree.add_block(block, is_verified)
+        if is_added and self.__block_store is not None and self.__block_store.append(block):
+            self.__blocks_since_snapshot += 1
+        return message, is_added
+
+    def save_snapshot(self) -> None:
+        '''
+        Saves state of blockchain tree next to stored blocks, so restart does not need to add all blocks again.
+
+        State is copied under pool lock, then it is serialized and written while
+        new blocks can be added. Must not be called with pool lock held.
+        '''
+        if self.__block_store is None:
+            return
+        with self.__snapshot_lock:
+            with self.__lock:
+                state = self.__blockchain_tree.to_snapshot()
+                # every accepted block is appended under pool lock - state covers exactly these blocks
+                block_count = self.__block_store.count()
+                head_hash = self.get_head_hash()
+                self.__blocks_since_snapshot = 0
+            self.__block_store.save_snapshot(state, block_count)
+        self.__logger.info(f'Saved blockchain snapshot at head {head_hash}')
+
+    def __restore(self) -> None:
+        '''
+        Restores blocks from block store - from the latest snapshot and blocks stored after it.
+        Blocks covered by snapshot are read from the store when they are used.
+        '''
+        block_count = 0
+        snapshot = self.__block_store.load_snapshot()
+        if snapshot is not None:
+            block_count, state = snapshot
+            self.__blockchain_tree = BlockchainTree.from_snapshot(
+                state, self.__block_store.get_stored_block, self.__logger)
+            self.__logger.info(f'Restored {block_count} blocks from snapshot')
+        replayed_blocks = 0
+        for block in self.__block_store.iter_blocks(block_count):
+            self.add_block(block)
+            replayed_blocks += 1
+        self.__logger.info(f'Replayed {replayed_blocks} blocks stored after snapshot')
+
     def get_blockchain_tree(self) -> BlockchainTree:
         return self.__blockchain_tree
     
@@ -41,17 +178,33 @@ class BlockchainPool:
         if self.__blockchain_tree is None:
             return
         return self.__blockchain_tree.get_blockchain()
+
+    def get_head_hash(self) -> str | None:
+        '''
+        Returns hash of the last block in main blockchain.
+        '''
+        if self.__blockchain_tree is None:
+            return None
+        return self.__blockchain_tree.get_main_head_hash()
     
     def get_all_blocks(self) -> list[Block]:
         if self.__blockchain_tree is None:
             return []
         blocks = self.__blockchain_tree.get_all_blocks()
-        blocks.extend(self.__orphan_blocks)
+        blocks.extend(self.__orphan_blocks.values())
         return blocks
     
     @staticmethod
-    def create_blockchain_pool(blocks: list[Block], logger: Logger):
-        blockchain_pool = BlockchainPool(genesis_block=None, logger=logger)
+    def create_blockchain_pool(blocks: list[Block], logger: Logger, block_store: BlockStore | None = None,
+                               are_blocks_verified: bool = False):
+        '''
+        Creates pool from blocks restored from block store and given blocks.
+
+        :param are_blocks_verified: Given blocks were already checked (e.g. by `BlockChain.create_blockchain`).
+        '''
+        blockchain_pool = BlockchainPool(genesis_block=None, logger=logger, block_store=block_store)
+        if block_store is not None and block_store.count() > 0:
+            blockchain_pool.__restore()
         for block in blocks:
-            blockchain_pool.add_block(block=block)
+            blockchain_pool.add_block(block=block, is_verified=are_blocks_verified)
         return blockchain_pool
\ No newline at end of file
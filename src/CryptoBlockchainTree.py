@@ -1,49 +1,228 @@
 from CryptoBlock import Block
 from CryptoBlockchain import BlockChain
 from CryptoTransaction import Transaction
+from CryptoUtxoIndex import UtxoIndex
+from CryptoChainEvent import ChainEvent, CHAIN_CONNECT, CHAIN_DISCONNECT
 from logging import Logger
-import json
-from functools import cmp_to_key
+from typing import Callable
+import time
 
 class BlockchainTree:
     __genesis_block: Block = None
-    __blocks_map: dict[str, Block] = {}
+    __blocks_map: dict[str, Block] = None
     __logger: Logger = None
+    __utxo_index: UtxoIndex = None
+    # block hash -> block height (genesis block has height 0)
+    __heights: dict[str, int] = None
+    # block hash -> work of all blocks from genesis block to the block (inclusive)
+    __works: dict[str, int] = None
+    # block hash -> block without children
+    __heads: dict[str, Block] = None
+    __main_head_hash: str = None
+    # main blockchain and hashes of its blocks indexed by height
+    __main_blockchain: BlockChain = None
+    __main_blockchain_hashes: list[str] = None
+    # transaction id -> number of main blockchain blocks containing it
+    __applied_transaction_ids: dict[str, int] = None
+    # transaction id -> transaction present only in blocks out of main blockchain
+    __lost_transactions: dict[str, Transaction] = None
+    # lost transactions valid for main blockchain, with number of tree changes they were found for
+    __ready_lost_transactions: tuple[int, list[Transaction]] = None
+    # incremented on every change of main blockchain or lost transactions
+    __version: int = None
+    # functions called with ordered events when blocks are connected to or disconnected from main blockchain
+    __chain_listeners: list[Callable[[list[ChainEvent]], None]] = None
 
     def __init__(self, genesis_block: Block | None, logger: Logger) -> None:
-        self.__genesis_block = genesis_block
+        self.__genesis_block = None
         self.__logger = logger
-        if self.__genesis_block != None:
-            self.__blocks_map[genesis_block.get_block_hash()] = self.__genesis_block
-        
+        self.__blocks_map = {}
+        self.__heights = {}
+        self.__works = {}
+        self.__heads = {}
+        self.__utxo_index = UtxoIndex()
+        self.__main_blockchain_hashes = []
+        self.__applied_transaction_ids = {}
+        self.__lost_transactions = {}
+        self.__version = 0
+        self.__chain_listeners = []
+        if genesis_block != None:
+            self.add_block(genesis_block)
 
-    def add_block(self, block: Block) -> tuple[str, bool]:
-        added_genesis_block = False
-        if self.__genesis_block == None:
-            self.__genesis_block = block
-            added_genesis_block = True
-        elif block.get_prev_hash() not in self.__blocks_map:
+    def add_block(self, block: Block, is_verified: bool = False) -> tuple[str, bool]:
+        '''
+        Adds block to the tree and moves main blockchain when the block makes the chain with the most work.
+
+        :param is_verified: Block was already checked (proof of work, hash_prev_nonce) - it is not checked again.
+        '''
+        block_hash = block.get_block_hash()
+        if self.__genesis_block != None and block.get_prev_hash() not in self.__blocks_map:
             return 'Previous block is not present in the tree', False
-        if block.get_block_hash() in self.__blocks_map:
+        if block_hash in self.__blocks_map:
             self.__logger.warning(
                 f'Try to add block which already exists {block.to_json()}')
-            if added_genesis_block:
-                self.__genesis_block = None # clear already added genesis block
             return f'Try to add block which already exists {block.to_json()}', False
-        self.__blocks_map[block.get_block_hash()] = block
+        self.__blocks_map[block_hash] = block
+        self.__version += 1
+
+        if self.__genesis_block == None:
+            self.__genesis_block = block
+            self.__heights[block_hash] = 0
+            self.__works[block_hash] = block.get_work()
+            self.__heads[block_hash] = block
+            self.__main_head_hash = block_hash
+            self.__main_blockchain = BlockChain(block)
+            self.__main_blockchain.set_utxo_index(self.__utxo_index)
+            self.__utxo_index.connect_block(block, block_hash)
+            self.__main_blockchain_hashes.append(block_hash)
+            self.__apply_transactions(block)
+            if not is_verified and not block.verify_block():
+                self.__logger.warning('blockchain NOT valid')
+            self.__notify_chain_listeners([ChainEvent(CHAIN_CONNECT, block, block_hash, 0, [])])
+            return 'Ok', True
+
+        self.__heights[block_hash] = self.__heights[block.get_prev_hash()] + 1
+        self.__works[block_hash] = self.__works[block.get_prev_hash()] + block.get_work()
+        self.__heads.pop(block.get_prev_hash(), None)
+        self.__heads[block_hash] = block
+        # the chain with the most work wins, on equal work the first seen head is kept
+        if self.__works[block_hash] > self.__works[self.__main_head_hash]:
+            self.__set_main_head(block_hash, is_verified)
+        else:
+            for transaction in block.get_transactions():
+                if transaction.get_transaction_id() not in self.__applied_transaction_ids:
+                    self.__lost_transactions[transaction.get_transaction_id()] = transaction
         return 'Ok', True
 
+    def add_chain_listener(self, listener: Callable[[list[ChainEvent]], None]) -> None:
+        self.__chain_listeners.append(listener)
+
+    def __set_main_head(self, head_hash: str, is_head_verified: bool = False) -> None:
+        '''
+        Moves main blockchain to the new head.
+        Only blocks after the fork point are removed from and added to main blockchain,
+        every removed and added block is reported to chain listeners.
+        '''
+        begin = time.perf_counter()
+        branch = []
+        current_hash = head_hash
+        while not self.__is_in_main_blockchain(current_hash):
+            branch.append(self.__blocks_map[current_hash])
+            current_hash = self.__blocks_map[current_hash].get_prev_hash()
+        fork_height = self.__heights[current_hash]
+        events = []
+        while len(self.__main_blockchain_hashes) > fork_height + 1:
+            height = len(self.__main_blockchain_hashes) - 1
+            # undo record is dropped together with the block
+            spent_inputs = self.__utxo_index.get_spent_inputs(height)
+            block = self.__main_blockchain.pop_block()
+            self.__revert_transactions(block)
+            events.append(ChainEvent(CHAIN_DISCONNECT, block, self.__main_blockchain_hashes.pop(), height, spent_inputs))
+        for block in reversed(branch):
+            block_hash = block.get_block_hash()
+            # other blocks of the branch were added to the tree without checks
+            is_verified = is_head_verified and block_hash == head_hash
+            if not is_verified and not self.__main_blockchain.validate_candidate_block(block):
+                self.__logger.warning('blockchain NOT valid')
+            self.__main_blockchain.add_block(block)
+            self.__main_blockchain_hashes.append(block_hash)
+            self.__apply_transactions(block)
+            height = len(self.__main_blockchain_hashes) - 1
+            events.append(ChainEvent(CHAIN_CONNECT, block, block_hash, height, self.__utxo_index.get_spent_inputs(height)))
+        self.__main_head_hash = head_hash
+        if len(events) > len(branch):
+            self.__logger.info(f'Reorganization at height {fork_height}: {len(events) - len(branch)} blocks disconnected, '
+                               f'{len(branch)} connected in {time.perf_counter() - begin:.5f} sec.')
+        self.__notify_chain_listeners(events)
+
+    def __notify_chain_listeners(self, events: list[ChainEvent]) -> None:
+        for listener in self.__chain_listeners:
+            listener(events)
+
+    def __apply_transactions(self, block: Block) -> None:
+        '''
+        Marks transactions of block added to main blockchain as applied.
+        '''
+        for transaction in block.get_transactions():
+            transaction_id = transaction.get_transaction_id()
+            self.__applied_transaction_ids[transaction_id] = self.__applied_transaction_ids.get(transaction_id, 0) + 1
+            self.__lost_transactions.pop(transaction_id, None)
+
+    def __revert_transactions(self, block: Block) -> None:
+        '''
+        Marks transactions of block removed from main blockchain as lost - unless other main blockchain block contains them.
+        '''
+        for transaction in block.get_transactions():
+            transaction_id = transaction.get_transaction_id()
+            count = self.__applied_transaction_ids[transaction_id] - 1
+            if count > 0:
+                self.__applied_transaction_ids[transaction_id] = count
+            else:
+                del self.__applied_transaction_ids[transaction_id]
+                self.__lost_transactions[transaction_id] = transaction
+
+    def to_snapshot(self) -> dict:
+        '''
+        Returns tree state (without block bodies) as JSON-serializable dictionary.
+        '''
+        return {
+            'genesis_hash': None if self.__genesis_block is None else self.__main_blockchain_hashes[0],
+            # block hash, height, previous block hash and work in order of adding - blocks are not read on restore
+            'blocks': [[block_hash, self.__heights[block_hash], block.get_prev_hash(), self.__works[block_hash]]
+                       for block_hash, block in self.__blocks_map.items()],
+            'heads': list(self.__heads),
+            'main_head_hash': self.__main_head_hash,
+            'main_blockchain_hashes': list(self.__main_blockchain_hashes),
+            'utxo_index': self.__utxo_index.to_snapshot(),
+            # saved with the tree, so restore does not parse transactions of every block
+            'applied_transaction_ids': dict(self.__applied_transaction_ids),
+            'lost_transactions': [transaction.to_json() for transaction in self.__lost_transactions.values()]
+        }
+
+    @staticmethod
+    def from_snapshot(snapshot: dict, get_block: Callable[[str, str | None], Block], logger: Logger):
+        '''
+        Restores tree saved with `to_snapshot`. Blocks are not hashed nor validated again.
+
+        :param get_block: Returns block for block hash and previous block hash - block can be read when it is used.
+        '''
+        blockchain_tree = BlockchainTree(None, logger)
+        if snapshot['genesis_hash'] is None:
+            return blockchain_tree
+        blocks = blockchain_tree.__blocks_map
+        for block_hash, height, prev_hash, work in snapshot['blocks']:
+            blocks[block_hash] = get_block(block_hash, prev_hash)
+            blockchain_tree.__heights[block_hash] = height
+            blockchain_tree.__works[block_hash] = work
+        blockchain_tree.__genesis_block = blocks[snapshot['genesis_hash']]
+        blockchain_tree.__heads = {block_hash: blocks[block_hash] for block_hash in snapshot['heads']}
+        blockchain_tree.__main_head_hash = snapshot['main_head_hash']
+        blockchain_tree.__main_blockchain_hashes = list(snapshot['main_blockchain_hashes'])
+        main_blockchain = BlockChain(None)
+        for block_hash in blockchain_tree.__main_blockchain_hashes:
+            main_blockchain.add_block(blocks[block_hash])
+        blockchain_tree.__utxo_index = UtxoIndex.from_snapshot(snapshot['utxo_index'])
+        main_blockchain.set_utxo_index(blockchain_tree.__utxo_index)
+        blockchain_tree.__main_blockchain = main_blockchain
+        blockchain_tree.__applied_transaction_ids = dict(snapshot['applied_transaction_ids'])
+        for transaction_data in snapshot['lost_transactions']:
+            transaction = Transaction.create_from_json(transaction_data)
+            blockchain_tree.__lost_transactions[transaction.get_transaction_id()] = transaction
+        return blockchain_tree
+
+    def __is_in_main_blockchain(self, block_hash: str) -> bool:
+        height = self.__heights[block_hash]
+        return height < len(self.__main_blockchain_hashes) and self.__main_blockchain_hashes[height] == block_hash
+
     def to_tree_structure(self):
-        main_head = self.get_blockchain().get_blocks()[-1]
-        all_blocks = self.__blocks_map.values()
         all_structs = []
-        for block in all_blocks:
+        for block_hash, block in self.__blocks_map.items():
             message = ''
-            if block.get_block_hash() == self.__genesis_block.get_block_hash():
+            if block is self.__genesis_block:
                 message = 'Genesis block'
-            elif block.get_block_hash() == main_head.get_block_hash():
+            elif block_hash == self.__main_head_hash:
                 message = 'HEAD'
-            item = {'name': block.get_block_hash(),
+            item = {'name': block_hash,
                     'manager': block.get_prev_hash(),
                     'toolTip': '',
                     'body': block.to_json(),
@@ -52,56 +231,92 @@ class BlockchainTree:
                     }
             all_structs.append(item)
         return all_structs
-    
-    def __get_heads(self) -> list[Block]:
-        block_hashes = list(self.__blocks_map.keys())
-        for block in list(self.__blocks_map.values()):
-            if block.get_prev_hash() in block_hashes:
-                block_hashes.remove(block.get_prev_hash())
-        heads = [self.__blocks_map[hash] for hash in block_hashes]
-        return heads
-    
-    def __get_block_blockchain(self, block: Block):
-        blocks = [block]
-        current_block = block
-        while current_block.get_prev_hash() in self.__blocks_map:
-            blocks.append(self.__blocks_map[current_block.get_prev_hash()])
-            current_block = self.__blocks_map[current_block.get_prev_hash()]
-        blocks.reverse()
-        return blocks
-    
-    def __compare_block_blockchains(self, bcb_a: list[list[Block]], bcb_b: list[list[Block]]):
+
+    def get_heads(self) -> list[Block]:
+        return list(self.__heads.values())
+
+    def get_main_head(self) -> Block | None:
         '''
-        Compare function for func:get_blockchain.
-        
-        Returns:
-         -  1 for A <  B
-         - -1 for A >= B
+        Returns last block of main blockchain.
         '''
-        if len(bcb_a) != len(bcb_b):
-                return 1 if len(bcb_a) < len(bcb_b) else -1
-        return 0
-    
+        if self.__main_head_hash is None:
+            return None
+        return self.__blocks_map[self.__main_head_hash]
+
+    def get_main_head_hash(self) -> str | None:
+        return self.__main_head_hash
+
     def get_blockchain(self) -> BlockChain | None:
         '''
         Returns main blockchain in blockchain tree.
         If there is no block in blockchain tree - it returns None.
         '''
-        heads = self.__get_heads()
-        if len(heads) == 0:
-            return None
-        blockchains_blocks = [self.__get_block_blockchain(head) for head in heads]
-        blockchains_blocks.sort(key=cmp_to_key(self.__compare_block_blockchains))
-        selected_blockchain_blocks = blockchains_blocks[0]
-        blockchain = BlockChain(selected_blockchain_blocks[0])
-        for block in selected_blockchain_blocks[1:]:
-            blockchain.add_block(block)
-        if not blockchain.validate():
-            self.__logger.warning('blockchain NOT valid')
-        return blockchain
+        return self.__main_blockchain
 
     def get_all_blocks(self) -> list[Block]:
         return [block for block in self.__blocks_map.values()]
+
+    def get_work_of(self, block_hash: str) -> int | None:
+        '''
+        Returns cumulative work of blockchain ending with the block.
+        '''
+        return self.__works.get(block_hash)
+
+    def contains(self, block_hash: str) -> bool:
+        return block_hash in self.__blocks_map
+
+    def get_block(self, block_hash: str) -> Block | None:
+        return self.__blocks_map.get(block_hash)
+
+    def get_main_height(self) -> int:
+        '''
+        Returns height of main blockchain head (-1 if tree is empty).
+        '''
+        return len(self.__main_blockchain_hashes) - 1
+
+    def get_main_height_of(self, block_hash: str) -> int | None:
+        '''
+        Returns height of block if it is in main blockchain, otherwise None.
+        '''
+        if block_hash not in self.__heights or not self.__is_in_main_blockchain(block_hash):
+            return None
+        return self.__heights[block_hash]
+
+    def get_main_blocks(self, start_height: int, limit: int) -> list[Block]:
+        '''
+        Returns up to limit blocks of main blockchain starting from height.
+        '''
+        if self.__main_blockchain is None:
+            return []
+        return self.__main_blockchain.get_blocks()[start_height:start_height + limit]
+
+    def get_locator(self) -> list[str]:
+        '''
+        Returns hashes of main blockchain blocks describing its state - the newest
+        blocks one by one, then with exponentially growing gaps, ending with genesis block.
+        Node receiving locator finds the last common block with one lookup per hash.
+        '''
+        locator = []
+        height = self.get_main_height()
+        step = 1
+        while height > 0:
+            locator.append(self.__main_blockchain_hashes[height])
+            if len(locator) >= 10:
+                step *= 2
+            height -= step
+        if len(self.__main_blockchain_hashes) > 0:
+            locator.append(self.__main_blockchain_hashes[0])
+        return locator
+
+    def find_fork_height(self, locator: list[str]) -> int:
+        '''
+        Returns height of the first locator block found in main blockchain (-1 if none is found).
+        '''
+        for block_hash in locator:
+            height = self.get_main_height_of(block_hash)
+            if height is not None:
+                return height
+        return -1
     
     def get_all_transactions(self) -> list[Transaction]:
         '''
@@ -120,26 +335,33 @@ class BlockchainTree:
         Returns transactions lost in forks - out of main blockchain.
         '''
 
-        blockchain = self.get_blockchain()
-        if blockchain is None:
+        if self.get_blockchain() is None:
             self.__logger.warning('No blockchain in blockchainTree')
             return []
-        blockchain_transactions = blockchain.get_transactions()
-        blockchain_transaction_ids = [transaction.get_transaction_id() for transaction in blockchain_transactions]
-        all_transactions = self.get_all_transactions()
-        lost_transactions = [transaction for transaction in all_transactions if transaction.get_transaction_id() not in blockchain_transaction_ids]
-        return lost_transactions
+        return list(self.__lost_transactions.values())
+
+    def get_applied_transaction_ids(self):
+        '''
+        Returns ids of transactions in main blockchain - live view updated together with the tree.
+        '''
+        return self.__applied_transaction_ids.keys()
     
     def get_lost_transactions_ready_to_apply(self):
         '''
         Returns transations that have inputs not used before in chain.
+        Result is kept until main blockchain or lost transactions change.
         '''
+        version = self.__version
+        if self.__ready_lost_transactions is not None and self.__ready_lost_transactions[0] == version:
+            return list(self.__ready_lost_transactions[1])
         blockchain = self.get_blockchain()
         lost_transactions = self.get_transactions_lost_in_forks()
+        Transaction.verify_signatures(lost_transactions)
         ready_to_apply_transactions = []
         for transaction in lost_transactions:
             _, is_valid = blockchain.is_valid_transaction_candidate(transaction)
             if is_valid:
                 ready_to_apply_transactions.append(transaction)
-        return ready_to_apply_transactions
+        self.__ready_lost_transactions = (version, ready_to_apply_transactions)
+        return list(ready_to_apply_transactions)
              
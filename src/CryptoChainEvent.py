@@ -0,0 +1,46 @@
+from CryptoBlock import Block
+from CryptoInput import Input
+
+CHAIN_CONNECT = 'connect'
+CHAIN_DISCONNECT = 'disconnect'
+
+
+class ChainEvent:
+    '''
+    Block connected to or disconnected from main blockchain.
+
+    When head of main blockchain changes, listeners get events in the order
+    they were applied - blocks disconnected from the old head down to the fork
+    point, then blocks connected from the fork point up to the new head.
+    '''
+    __kind: str = None
+    __block: Block = None
+    __block_hash: str = None
+    __height: int = None
+    # outputs spent by block transactions - they are available again when block is disconnected
+    __spent_inputs: list[Input] = None
+
+    def __init__(self, kind: str, block: Block, block_hash: str, height: int, spent_inputs: list[Input]) -> None:
+        self.__kind = kind
+        self.__block = block
+        self.__block_hash = block_hash
+        self.__height = height
+        self.__spent_inputs = spent_inputs
+
+    def get_kind(self) -> str:
+        return self.__kind
+
+    def is_connect(self) -> bool:
+        return self.__kind == CHAIN_CONNECT
+
+    def get_block(self) -> Block:
+        return self.__block
+
+    def get_block_hash(self) -> str:
+        return self.__block_hash
+
+    def get_height(self) -> int:
+        return self.__height
+
+    def get_spent_inputs(self) -> list[Input]:
+        return self.__spent_inputs
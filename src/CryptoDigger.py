@@ -5,23 +5,36 @@ import os
 from CryptoTransactionPool import TransactionPool, Transaction
 from CryptoKeyManager import KeyManager
 from CryptoBlockchainPool import BlockchainPool
-from CryptoBlockchain import BLOCK_PRICE_AMOUNT
-from CryptoInput import BLOCK_PRICE_ID
-import time
+from CryptoBlockStore import BlockStore
+from CryptoInput import BLOCK_PRICE_ID, BLOCK_PRICE_AMOUNT
 from logging import Logger
 from datetime import datetime
 from CryptoInput import Input
+from CryptoBlockTemplate import BlockTemplate, BlockTemplateBuilder, MAX_TEMPLATE_CANDIDATES
+from CryptoProofOfWork import ParallelProofOfWork, ProofOfWorkEngine, STOP_CHECK_NONCES
+from CryptoChainEvent import ChainEvent
+from collections import deque
 
 max_nonce = 2 ** 32     # 4 billion
 
 class Digger():
-    __is_waiting: bool = None
+    # set when mining is not paused
+    __is_resumed: threading.Event = None
+    # set when head of main blockchain changed
+    __head_changed: threading.Event = None
+    # set when new transaction was added to transaction pool
+    __transactions_changed: threading.Event = None
+    # ids of transactions connected to main blockchain - removed from transaction pool by mining loop
+    __connected_transaction_ids: deque = None
+    __is_template_full: bool = None
+    __block_template_builder: BlockTemplateBuilder = None
     __is_terminated: bool = None
     __blockchain_pool: BlockchainPool = None
     __worker = None
     __transaction_pool: TransactionPool = None
     __key_manager: KeyManager = None
     __logger: Logger = None
+    __parallel_proof_of_work: ParallelProofOfWork = None
 
     __spread_candidate_block_function = None
 
@@ -34,17 +47,31 @@ class Digger():
         # }
     ]
 
-    def __init__(self, blocks: list[Block], key_manager: KeyManager, logger: Logger, spread_block_function):
-        self.__is_waiting = False
+    def __init__(self, blocks: list[Block], key_manager: KeyManager, logger: Logger, spread_block_function, mining_workers: int = 1, block_store: BlockStore | None = None, request_block_function=None, are_blocks_verified: bool = False):
+        self.__is_resumed = threading.Event()
+        self.__is_resumed.set()
+        self.__head_changed = threading.Event()
+        self.__connected_transaction_ids = deque()
+        self.__transactions_changed = threading.Event()
+        self.__is_template_full = True
         self.__is_terminated = False
         self.__transaction_pool = TransactionPool()
         self.__key_manager = key_manager
         self.__logger = logger
         self.__spread_candidate_block_function = spread_block_function
-        self.__blockchain_pool = BlockchainPool.create_blockchain_pool(blocks=blocks, logger=self.__logger)
+        self.__blockchain_pool = BlockchainPool.create_blockchain_pool(
+            blocks=blocks, logger=self.__logger, block_store=block_store, are_blocks_verified=are_blocks_verified)
+        self.__blockchain_pool.add_head_listener(self.__on_head_changed)
+        self.__blockchain_pool.add_chain_listener(self.__on_chain_changed)
+        if request_block_function is not None:
+            # parents of orphan blocks are requested from other nodes
+            self.__blockchain_pool.add_missing_block_listener(request_block_function)
+        self.__block_template_builder = BlockTemplateBuilder(self.__logger)
+        if mining_workers > 1:
+            self.__parallel_proof_of_work = ParallelProofOfWork(mining_workers, self.__logger)
 
     def start_mining(self) -> None:
-        self.__is_waiting = False
+        self.__is_resumed.set()
         self.__worker = threading.Thread(target=self.__w_start, args=())
         self.__worker.start()
 
@@ -71,24 +98,28 @@ class Digger():
             self.__logger.info('Created blockchain_Tree')
 
         while not self.__is_terminated:
+            # transactions added from now on can refresh block template
+            self.__transactions_changed.clear()
+            connected_transaction_ids = set()
+            while len(self.__connected_transaction_ids) > 0:
+                connected_transaction_ids.add(self.__connected_transaction_ids.popleft())
+            self.__transaction_pool.remove_transactions(connected_transaction_ids)
             lost_transactions = self.__blockchain_pool.get_blockchain_tree().get_lost_transactions_ready_to_apply()
-            aplied_transaction_ids = [transaction.get_transaction_id() for transaction in self.__blockchain_pool.get_blockchain().get_transactions()]
-            transaction_data_obj = self.__transaction_pool.get_next_transaction(lost_transactions, aplied_transaction_ids)
-            block_data = {
-                'transactions': transaction_data_obj if transaction_data_obj is None else [transaction_data_obj.to_json()]
-            }
+            aplied_transaction_ids = self.__blockchain_pool.get_blockchain_tree().get_applied_transaction_ids()
+            pool_transactions = self.__transaction_pool.get_transactions(aplied_transaction_ids, MAX_TEMPLATE_CANDIDATES)
 
             begin = datetime.now()
 
-            # calculate previous block hash
-            previous_block_hash = self.__blockchain_pool.get_blockchain().get_blocks()[-1].get_block_hash()
+            # calculate previous block hash - head changes from now on interrupt mining
+            self.__head_changed.clear()
+            previous_block_hash = self.__blockchain_pool.get_head_hash()
             double_spending_record_idx = -1
             current_transaction_id = None
-            if transaction_data_obj is not None:
-                current_transaction_id = transaction_data_obj.get_transaction_id()
-                self.__logger.info(f"Previous block hash: {previous_block_hash}")
+            if len(pool_transactions) > 0:
+                current_transaction_id = pool_transactions[0].get_transaction_id()
                 for i in range(len(self.__double_spending_pairs)):
                     if current_transaction_id in self.__double_spending_pairs[i]['transaction_ids']:
+                        self.__logger.info(f"Previous block hash: {previous_block_hash}")
                         if self.__double_spending_pairs[i]['previous_block_hash'] is None:
                             self.__double_spending_pairs[i]['previous_block_hash'] = previous_block_hash
                             self.__logger.info(f"Assigning previous block hash as {previous_block_hash}")
@@ -98,8 +129,26 @@ class Digger():
                         double_spending_record_idx = i
                         break
 
+            if double_spending_record_idx != -1:
+                # double spending transaction is mined alone on fixed previous block
+                block_template = BlockTemplate([pool_transactions[0]], [], True)
+            else:
+                double_spending_transaction_ids = set(
+                    transaction_id for pair in self.__double_spending_pairs for transaction_id in pair['transaction_ids'])
+                candidates = [transaction for transaction in pool_transactions
+                              if transaction.get_transaction_id() not in double_spending_transaction_ids]
+                block_template = self.__block_template_builder.build(
+                    self.__blockchain_pool.get_blockchain(), candidates + lost_transactions)
+                rejected_transaction_ids = set(
+                    transaction.get_transaction_id() for transaction in block_template.get_rejected_transactions())
+                if len(rejected_transaction_ids) > 0:
+                    self.__logger.info(f'Removing {len(rejected_transaction_ids)} invalid transactions from transaction pool')
+                    self.__transaction_pool.remove_transactions(rejected_transaction_ids)
+            self.__is_template_full = block_template.is_full()
+            self.__logger.info(f'Block template with {len(block_template.get_transactions())} transactions')
+
             candidate_block = Block(previous_block_hash,
-                                    block_data,
+                                    block_template.to_block_data(),
                                     self.__key_manager.public_key)
 
             (nonce, is_successfull) = self.__proof_of_work(candidate_block)
@@ -116,28 +165,26 @@ class Digger():
             # calculate hash from prev_block_hash value + nonce to keep consistency in blockchain
             candidate_block.set_prev_hash_nonce(candidate_block.calculate_hash_prev_block_nonce())
 
-            counter = 0
-            while self.__is_waiting and not self.__is_terminated:
-                time.sleep(0.001)
-                if counter % 1000 == 0:
-                    self.__logger.info(
-                        "Waiting another second for processing candidate block")
-                counter += 1
+            while not self.__is_resumed.wait(timeout=1) and not self.__is_terminated:
+                self.__logger.info(
+                    "Waiting another second for processing candidate block")
 
             if self.__is_terminated:
                 self.__logger.warning('Is terminated')
                 continue
 
-            if candidate_block.get_prev_hash() != self.__blockchain_pool.get_blockchain().get_blocks()[-1].get_block_hash():
+            if candidate_block.get_prev_hash() != self.__blockchain_pool.get_head_hash():
                 self.__logger.warning('Not actual last block')
                 if double_spending_record_idx == -1:
                     continue
 
             self.__propagate_candidate_block(candidate_block)
-            if transaction_data_obj is not None:
-                self.__logger.info(f'Pop transaction: {str(transaction_data_obj.to_json())}')
-                self.__transaction_pool.pop_next_transaction()
-                self.__logger.info(f"Transaction pool status after popping: {self.__transaction_pool.count()}")
+            if len(block_template.get_transactions()) > 0:
+                mined_transaction_ids = set(
+                    transaction.get_transaction_id() for transaction in block_template.get_transactions())
+                self.__logger.info(f'Remove mined transactions: {mined_transaction_ids}')
+                self.__transaction_pool.remove_transactions(mined_transaction_ids)
+                self.__logger.info(f"Transaction pool status after removing: {self.__transaction_pool.count()}")
 
                 # remove redundancy for currently processed transaction
                 if double_spending_record_idx != -1:
@@ -152,13 +199,34 @@ class Digger():
         self.__logger.info("Mining terminated...")
 
     def pause_mining(self) -> None:
-        self.__is_waiting = True
+        self.__is_resumed.clear()
 
     def resume_mining(self) -> None:
-        self.__is_waiting = False
+        self.__is_resumed.set()
 
     def terminate_mining(self) -> None:
         self.__is_terminated = True
+        # wake up paused miner
+        self.__is_resumed.set()
+
+    def __on_chain_changed(self, events: list[ChainEvent]) -> None:
+        '''
+        Called by blockchain tree with blocks connected to and disconnected from main blockchain.
+        Transactions of disconnected blocks are picked up again as transactions lost in forks.
+        '''
+        for event in events:
+            if event.is_connect():
+                self.__connected_transaction_ids.extend(
+                    transaction.get_transaction_id() for transaction in event.get_block().get_transactions())
+
+    def __on_head_changed(self, head_hash: str) -> None:
+        '''
+        Called by blockchain pool when head of main blockchain changes.
+        '''
+        self.__head_changed.set()
+        # double spending blocks are mined on fixed previous block
+        if self.__parallel_proof_of_work is not None and len(self.__double_spending_pairs) == 0:
+            self.__parallel_proof_of_work.abort()
 
     def __propagate_candidate_block(self, candidate_block: Block) -> bool:
         if self.__spread_candidate_block_function is not None:
@@ -169,8 +237,15 @@ class Digger():
             return False
 
     def add_transaction(self, transaction: Transaction) -> None:
-        self.__transaction_pool.add_transaction(transaction)
+        message, is_added = self.__transaction_pool.add_transaction(transaction)
+        if not is_added:
+            self.__logger.info(f"Transaction {transaction.get_transaction_id()} not added to transaction pool: {message}")
+            return
         self.__logger.info(f"Transaction pool status after transaction adding: {str(self.__transaction_pool.count())}")
+        self.__transactions_changed.set()
+        # there is room for new transaction in currently mined block
+        if self.__parallel_proof_of_work is not None and not self.__is_template_full:
+            self.__parallel_proof_of_work.abort()
 
     def __proof_of_work(self, block: Block) -> tuple[int, bool]:
         '''
@@ -178,16 +253,23 @@ class Digger():
 
         :returns: Tuple of valid nonce (if found, otherwise, max possible nonce value - 1) and bool (if nonce is valid).
         '''
-        # calculate the difficulty target
-        for nonce in range(max_nonce):  # check all possible nonce values
-            # there was added new block to blockchain during mining
-            blockchain = self.__blockchain_pool.get_blockchain()
-            if blockchain is not None and len(blockchain.get_blocks()) > 0:
-                if len(self.__double_spending_pairs) == 0:
-                    if block.get_prev_hash() != blockchain.get_blocks()[-1].get_block_hash():
-                        return (nonce, False)
+        if self.__parallel_proof_of_work is not None:
+            return self.__parallel_proof_of_work.run(
+                block, max_nonce, lambda: self.__is_block_stale(block))
 
-            if block.verify_nonce(nonce):  # verify specific nonce value
+        engine = ProofOfWorkEngine.from_block(block)
+        # check all possible nonce values in batches
+        for batch_start in range(0, max_nonce, STOP_CHECK_NONCES):
+            # there was added new block to blockchain during mining
+            if self.__head_changed.is_set() and self.__is_block_stale(block):
+                return (batch_start, False)
+            # refresh block template with new transactions
+            if self.__transactions_changed.is_set() and not self.__is_template_full:
+                self.__logger.info('Refreshing block template with new transactions')
+                return (batch_start, False)
+
+            nonce = engine.search(range(batch_start, min(batch_start + STOP_CHECK_NONCES, max_nonce)))
+            if nonce is not None:
                 print(f"Success with nonce {nonce}")
                 return (nonce, True)
         nonce = max_nonce - 1
@@ -195,18 +277,30 @@ class Digger():
         print(f'Failed after {nonce} tries')
         return (nonce, False)
 
+    def __is_block_stale(self, block: Block) -> bool:
+        '''
+        Checks if new block was added to blockchain during mining.
+        Double spending blocks are mined on fixed previous block so they never get stale.
+        '''
+        head_hash = self.__blockchain_pool.get_head_hash()
+        if head_hash is None or len(self.__double_spending_pairs) != 0:
+            return False
+        return block.get_prev_hash() != head_hash
+
     def get_all_blocks(self):
         return self.__blockchain_pool.get_all_blocks()
     
     def get_blockchain_tree(self):
         return self.__blockchain_pool.get_blockchain_tree()
 
+    def save_snapshot(self) -> None:
+        self.__blockchain_pool.save_snapshot()
+
     def get_inputs(self, target_owner: str) -> list[Input]:
         return self.__blockchain_pool.get_blockchain().get_inputs(target_owner, self.__logger)
     
     def add_block(self, block: Block) -> tuple[str, bool]:
-        self.__blockchain_pool.add_block(block=block)
-        return 'Ok', True
+        return self.__blockchain_pool.add_block(block=block)
 
     @staticmethod
     def get_block_price_id():
@@ -4,22 +4,42 @@ from CryptoOutput import Output
 from logging import Logger
 
 BLOCK_PRICE_ID = 'block_mining_price'
+BLOCK_PRICE_AMOUNT = 5
 
 class Input(Output):
-    __transaction_id: str = None
+    __slots__ = ('__transaction_id', '__output_index')
+    __transaction_id: str
+    # index of spent output in source transaction outputs
+    # inputs created before outpoints were introduced have no index - they point to
+    # output of source transaction owned by input owner with the same amount
+    __output_index: int | None
 
-    def __init__(self, transaction_id: str, owner: str, amount: int) -> None:
+    def __init__(self, transaction_id: str, owner: str, amount: int, output_index: int | None = None) -> None:
         super().__init__(owner, amount)
         self.__transaction_id = transaction_id
+        self.__output_index = output_index
 
     def to_json(self):
-        return get_order_directory_recursively({
+        data = {
             **super().to_json(),
             'transaction_id': self.__transaction_id
-        })
+        }
+        # field is skipped for inputs without index, so their hashes and signatures do not change
+        if self.__output_index is not None:
+            data['output_index'] = self.__output_index
+        return get_order_directory_recursively(data)
 
     def get_transaction_id(self) -> str:
         return self.__transaction_id
+
+    def get_output_index(self) -> int | None:
+        return self.__output_index
+
+    def get_outpoint(self) -> tuple[str, int | None]:
+        '''
+        Returns (source transaction id, output index) - hashable reference to spent output.
+        '''
+        return self.__transaction_id, self.__output_index
     
     def is_block_price(self):
         return self.__transaction_id == BLOCK_PRICE_ID
@@ -46,6 +66,10 @@ class Input(Output):
             },
             'transaction_id': {
                 'type': str
+            },
+            'output_index': {
+                'type': int,
+                'optional': True
             }
         }
         return is_valid(config, data)
@@ -60,7 +84,8 @@ class Input(Output):
     
     @staticmethod
     def from_json(data: dict):
-        return Input(amount=data['amount'], transaction_id=data['transaction_id'], owner=data['owner'])
+        return Input(amount=data['amount'], transaction_id=data['transaction_id'], owner=data['owner'],
+                     output_index=data.get('output_index'))
     
     @staticmethod
     def from_list_json(data_list: list[dict]):
@@ -0,0 +1,61 @@
+from collections import OrderedDict
+from threading import Lock
+
+INVENTORY_BLOCK = 'block'
+INVENTORY_TRANSACTION = 'transaction'
+INVENTORY_KINDS = (INVENTORY_BLOCK, INVENTORY_TRANSACTION)
+
+# how many announced items are remembered as already seen
+SEEN_CACHE_SIZE = 10000
+# how many own announced items can be fetched by other nodes
+INVENTORY_SIZE = 1000
+
+
+class LruCache:
+    '''
+    Bounded mapping which drops least recently used items when it is full.
+
+    Used for inventory items - announced hashes already seen by node and bodies
+    of items announced by node. Safe to use from multiple request threads.
+    '''
+    __items: OrderedDict = None
+    __max_size: int = None
+    __lock: Lock = None
+
+    def __init__(self, max_size: int) -> None:
+        self.__items = OrderedDict()
+        self.__max_size = max_size
+        self.__lock = Lock()
+
+    def add(self, key, value=None) -> bool:
+        '''
+        Adds item to the cache.
+
+        :returns: False if key was already in the cache (value is not replaced), otherwise True.
+        '''
+        with self.__lock:
+            if key in self.__items:
+                self.__items.move_to_end(key)
+                return False
+            self.__items[key] = value
+            if len(self.__items) > self.__max_size:
+                self.__items.popitem(last=False)
+            return True
+
+    def get(self, key, default=None):
+        with self.__lock:
+            if key not in self.__items:
+                return default
+            self.__items.move_to_end(key)
+            return self.__items[key]
+
+    def remove(self, key) -> None:
+        with self.__lock:
+            self.__items.pop(key, None)
+
+    def __contains__(self, key) -> bool:
+        with self.__lock:
+            return key in self.__items
+
+    def __len__(self) -> int:
+        return len(self.__items)
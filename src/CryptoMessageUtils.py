@@ -1,5 +1,5 @@
-import json
-from nacl.signing import VerifyKey
+from CryptoUtils import to_hashed_bytes
+from CryptoSignatures import signature_verifier
 from CryptoKeyManager import KeyManager
 from CryptoTransaction import Transaction
 
@@ -10,7 +10,7 @@ class MessageUtils:
         pass
 
     def wrap_message(self, payload: dict):
-        payload_bytes = json.dumps(payload).encode('utf-8')
+        payload_bytes = to_hashed_bytes(payload)
         signature = self.__key_manager.sign(payload_bytes)
         return {
             'payload': payload,
@@ -19,9 +19,9 @@ class MessageUtils:
 
     def verify_message(self, frame: dict, sender_pk_bytes):
         payload = frame['payload']
-        payload_bytes = json.dumps(payload).encode('utf-8')
+        payload_bytes = to_hashed_bytes(payload)
         signature = bytes.fromhex(frame['signature'])
-        verify_key = VerifyKey(sender_pk_bytes)
+        verify_key = signature_verifier.get_verify_key(sender_pk_bytes.hex())
         # throw error if not correct
         verify_key.verify(payload_bytes, signature)
 
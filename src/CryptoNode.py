@@ -4,25 +4,45 @@ import requests
 from CryptoNodeInfo import NodeInfo
 from CryptoMessageUtils import MessageUtils
 from CryptoBlock import Block
+from CryptoBlockchain import BlockChain
 from CryptoKeyManager import KeyManager
 from CryptoTransaction import Transaction
-from threading import Thread
+from threading import Thread, local
+from concurrent.futures import ThreadPoolExecutor
 from CryptoInput import Input
 import os
 from CryptoUtils import (
     is_double_spending_transaction_request_valid
 )
+from CryptoInventory import LruCache, INVENTORY_BLOCK, INVENTORY_TRANSACTION, SEEN_CACHE_SIZE, INVENTORY_SIZE
+import json
 
 import uuid
 import time
 from CryptoDigger import Digger
+from CryptoBlockStore import BlockStore
 from CryptoOutput import Output
 import os
 import random
 
 BLOCKCHAIN_FILE_PATH = "blockchain.json"
+BLOCK_STORE_PATH = "blocks"
+JSON_CONTENT_TYPE = 'application/json'
 OK = 200
 BAD_REQUEST = 400
+NOT_FOUND = 404
+# number of nodes inventory is announced to at the same time
+SPREAD_WORKERS = 8
+# timeout of request to single node (seconds)
+SPREAD_TIMEOUT = 5
+# number of blocks requested in one page during synchronization
+BLOCKS_PAGE_SIZE = 500
+MAX_BLOCKS_PAGE_SIZE = 1000
+# delay before next try to get blocks from parent, doubled after every failure (seconds)
+SYNC_RETRY_DELAY = 1
+SYNC_MAX_RETRY_DELAY = 30
+# how many times sync starts again when fetched block left main blockchain of parent
+SYNC_MAX_RESTARTS = 5
 
 
 class Node():
@@ -34,13 +54,27 @@ class Node():
     port = None
     app = None
     __digger: Digger = None
+    __block_store: BlockStore = None
 
     __block_accept_probability: float = None
     __transaction_process_chance: float = None
+    __mining_workers: int = None
+    __spread_executor: ThreadPoolExecutor = None
+    # sessions with persistent connections of current thread (node address -> session),
+    # requests.Session is not safe to share between threads
+    __thread_sessions: local = None
+    # (kind, hash) of inventory items already announced to node
+    __seen_inventory: LruCache = None
+    # (kind, hash) -> serialized frame of items announced by node
+    __inventory: LruCache = None
+    # hashes of missing blocks requested from other nodes
+    __requested_blocks: LruCache = None
 
     def __setup(self, network_node_address):
         self.__logger.error('Node::__setup')
         blocks = []
+        # blocks from previous run are restored by digger - only missing ones are fetched from parent
+        self.__block_store = BlockStore(BLOCK_STORE_PATH, self.__logger)
 
         if network_node_address is not None:
             self.pub_list = []
@@ -59,34 +93,124 @@ class Node():
                     time.sleep(1)
 
             self.__logger.info("Success connection with parent")
-            # fetch blocks from parent
-            block_list = []
-            while len(block_list) == 0:
-                try:
-                    block_list = requests.get(
-                        url=f'http://{network_node_address}/blocks').json()
-                except:
-                    self.__logger.warning(
-                        f'Parent block list is empty - try again to get block list')
-            self.__logger.info(
-                f'Get block list: {block_list}')
-            blocks = Block.load_list(block_list)
         else:
             self.pub_list = [
                 NodeInfo(f"{socket.gethostbyname(socket.gethostname())}:5000",
                          self.__key_manager.public_key)
             ]
-            if os.path.exists(BLOCKCHAIN_FILE_PATH):
+            if self.__block_store.count() == 0 and os.path.exists(BLOCKCHAIN_FILE_PATH):
+                # blocks saved before block store was introduced
                 blocks = Block.load_blocks(BLOCKCHAIN_FILE_PATH)
                 if blocks is None:
                     raise ValueError(
                         "Could not load/parse existing blocks - remove file or correct it to start node.")
-
-        self.__digger = Digger(blocks, self.__key_manager, self.__logger, self.spread_candidate_block)
+                if len(blocks) > 0:
+                    # blocks are checked on all cores before they are added
+                    try:
+                        BlockChain.create_blockchain(blocks, workers=os.cpu_count() or 1)
+                    except ValueError as err:
+                        raise ValueError(
+                            f"Existing blocks are not valid blockchain - remove file or correct it to start node: {err}")
+
+        self.__digger = Digger(blocks, self.__key_manager, self.__logger, self.spread_candidate_block,
+                               mining_workers=self.__mining_workers, block_store=self.__block_store,
+                               request_block_function=self.request_block,
+                               # loaded blocks were checked in parallel above
+                               are_blocks_verified=True)
+        if network_node_address is not None:
+            self.__sync_blocks(network_node_address)
         self.__logger.info('Setup done')
         self.__digger.start_mining()
 
-    def __init__(self, network_node_address, secret_key, app, ignore_address: str = None, block_accept_probability: float = 1.0, transaction_process_chance: float = 1.0):
+    def __sync_blocks(self, address: str) -> None:
+        '''
+        Fetches blocks missing in main blockchain from node, page by page.
+
+        The first page is requested with locator of own main blockchain, so node
+        answers only with blocks after the last common block. When the last fetched
+        block leaves main blockchain of node, sync starts again with new locator after
+        a delay - at most `SYNC_MAX_RESTARTS` times, remaining blocks are
+        requested later when they are announced. Sync does not stop before genesis
+        block is fetched, otherwise node would mine its own one.
+        '''
+        blockchain_tree = self.__digger.get_blockchain_tree()
+        locator_params = {'locator': ','.join(blockchain_tree.get_locator()), 'limit': BLOCKS_PAGE_SIZE}
+        params = locator_params
+        retry_delay = SYNC_RETRY_DELAY
+        restarts = 0
+        while True:
+            try:
+                response = requests.get(url=f'http://{address}/blocks', params=params, timeout=SPREAD_TIMEOUT)
+                if response.status_code == NOT_FOUND:
+                    # last fetched block left main blockchain of node - start again with locator
+                    restarts += 1
+                    if restarts > SYNC_MAX_RESTARTS and blockchain_tree.get_main_height() >= 0:
+                        self.__logger.warning(f'Blockchain of {address} keeps changing - sync stopped')
+                        return
+                    self.__logger.warning(f'Last block left main blockchain of {address} - sync again in {retry_delay}s')
+                    time.sleep(retry_delay)
+                    retry_delay = min(retry_delay * 2, SYNC_MAX_RETRY_DELAY)
+                    locator_params['locator'] = ','.join(blockchain_tree.get_locator())
+                    params = locator_params
+                    continue
+                response.raise_for_status()
+                page = response.json()
+            except (requests.RequestException, ValueError) as err:
+                self.__logger.warning(f'Unable to get blocks from {address} - retry in {retry_delay}s: {err}')
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, SYNC_MAX_RETRY_DELAY)
+                continue
+
+            blocks = Block.load_list(page['blocks'])
+            for block in blocks:
+                self.__digger.add_block(block)
+            self.__logger.info(f'Got {len(blocks)} blocks from height {page["start_height"]} of {page["main_height"]}')
+            is_synchronized = page['start_height'] + len(blocks) > page['main_height']
+            if is_synchronized and blockchain_tree.get_main_height() >= 0:
+                return
+            if len(blocks) == 0:
+                # parent has no blocks yet
+                self.__logger.warning(f'Parent block list is empty - retry in {retry_delay}s')
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, SYNC_MAX_RETRY_DELAY)
+                continue
+            retry_delay = SYNC_RETRY_DELAY
+            params = {'from_hash': blocks[-1].get_block_hash(), 'limit': BLOCKS_PAGE_SIZE}
+
+    def get_blocks_page(self, locator: list[str] | None = None, from_hash: str | None = None,
+                        from_height: int | None = None, to_height: int | None = None, limit: int | None = None):
+        '''
+        Returns page of main blockchain blocks (block objects - serialized while response is sent).
+
+        Page starts after the first locator block found in main blockchain, after
+        `from_hash` block or at `from_height` (genesis block if none is given) and ends
+        at `to_height` (inclusive) or after `limit` blocks.
+        '''
+        blockchain_tree = self.__digger.get_blockchain_tree()
+        if locator is not None:
+            start_height = blockchain_tree.find_fork_height(locator) + 1
+        elif from_hash is not None:
+            height = blockchain_tree.get_main_height_of(from_hash)
+            if height is None:
+                return 'Block is not in main blockchain', NOT_FOUND
+            start_height = height + 1
+        elif from_height is not None:
+            start_height = max(from_height, 0)
+        else:
+            start_height = 0
+
+        if limit is None or limit <= 0 or limit > MAX_BLOCKS_PAGE_SIZE:
+            limit = MAX_BLOCKS_PAGE_SIZE
+        if to_height is not None:
+            limit = max(min(limit, to_height - start_height + 1), 0)
+        blocks = blockchain_tree.get_main_blocks(start_height, limit)
+        return {
+            'blocks': blocks,
+            'start_height': start_height,
+            'main_height': blockchain_tree.get_main_height()
+        }, OK
+
+    def __init__(self, network_node_address, secret_key, app, ignore_address: str = None, block_accept_probability: float = 1.0, transaction_process_chance: float = 1.0, mining_workers: int = 1):
         self.__key_manager = KeyManager(app.logger, secret_key)
         self.__ignore_address = ignore_address
         self.app = app
@@ -94,6 +218,12 @@ class Node():
         self.__message_utils = MessageUtils(self.__key_manager)
         self.__block_accept_probability = block_accept_probability
         self.__transaction_process_chance = transaction_process_chance
+        self.__mining_workers = mining_workers
+        self.__spread_executor = ThreadPoolExecutor(max_workers=SPREAD_WORKERS)
+        self.__thread_sessions = local()
+        self.__seen_inventory = LruCache(SEEN_CACHE_SIZE)
+        self.__inventory = LruCache(INVENTORY_SIZE)
+        self.__requested_blocks = LruCache(SEEN_CACHE_SIZE)
 
         setup_thread = Thread(target=self.__setup,
                               args=(network_node_address,))
@@ -125,7 +255,7 @@ class Node():
         frame = self.__message_utils.wrap_message(payload)
         address = self.get_address_by_public_key(receiver_public_key)
         requests.post(
-            url=f"http://{address}/message", json=frame)
+            url=f"http://{address}/message", json=frame, timeout=SPREAD_TIMEOUT)
 
     def read_message(self, frame: dict, sender_pk_hex: str):
         if sender_pk_hex is None:
@@ -198,48 +328,194 @@ class Node():
             return 'Unhandled message type', BAD_REQUEST
 
     def save_blockchain(self):
-        self.__digger.__blockchain.save(BLOCKCHAIN_FILE_PATH)
+        '''
+        Saves snapshot of blockchain state and exports main blockchain to JSON file.
+        '''
+        self.__digger.save_snapshot()
+        self.__digger.get_blockchain_tree().get_blockchain().save(BLOCKCHAIN_FILE_PATH)
 
     def spread_candidate_block(self, candidate_block: Block) -> None:
         '''
-        Spread candidate block to all nodes with new transaction.
+        Announce candidate block to all nodes.
         '''
-        self.spread_message({
+        self.announce_inventory(INVENTORY_BLOCK, candidate_block.get_block_hash(), {
             'type': 'new_block',
             'block': candidate_block.to_json()
         })
     
     def spread_candidate_transaction(self, transaction: Transaction) -> None:
         '''
-        Spread message to all nodes with new transaction.
+        Announce new transaction to all nodes.
         '''
-        self.spread_message({
+        self.announce_inventory(INVENTORY_TRANSACTION, transaction.get_transaction_id(), {
             'type': 'new_transaction',
             'transaction': transaction.to_json()
         })
     
-    def spread_message(self, payload: dict) -> None:
+    def announce_inventory(self, kind: str, item_hash: str, payload: dict) -> dict[str, tuple[bool, str]]:
         '''
-        Spread message to all known nodes.
+        Announce inventory item (block or transaction) to all known nodes.
         Ignore 'Ignore address' if set.
+
+        Only item hash is sent - nodes which have not seen the item yet fetch
+        its body from this node, so every node downloads the body once.
+
+        :returns: Node address -> (is accepted, response message or error).
         '''
-        if (payload['type'] == 'new_transaction'):
-            self.__logger.info(f"Spreading transaction candidate... {payload}")
         frame = self.__message_utils.wrap_message(payload)
+        # frame is serialized once for all nodes fetching it
+        self.__inventory.add((kind, item_hash), json.dumps(frame).encode('utf-8'))
 
-        nodes_that_reject = []
+        futures = {}
         for node in self.pub_list:
-
-            # we can be mean for some digger :)
-            # We are sending new block to everone except him.
             if node.address == self.__ignore_address:
                 continue
+            futures[node.address] = self.__spread_executor.submit(
+                self.__post_announcement, node.address, kind, item_hash)
+
+        results = {address: future.result() for address, future in futures.items()}
+        nodes_that_reject = [address for address, (is_accepted, _) in results.items() if not is_accepted]
+        if len(nodes_that_reject) > 0:
+            self.__logger.info(f'Inventory {kind} {item_hash} rejected by nodes: {nodes_that_reject}')
+        return results
+
+    def __post_announcement(self, address: str, kind: str, item_hash: str) -> tuple[bool, str]:
+        try:
+            response = self.__get_session(address).post(
+                url=f'http://{address}/inventory/{kind}/{item_hash}', timeout=SPREAD_TIMEOUT)
+            return response.ok, response.text
+        except requests.RequestException as err:
+            return False, str(err)
+
+    def read_inventory(self, kind: str, item_hash: str, sender_address: str):
+        '''
+        Handles inventory item announced by other node.
+
+        Already seen items are dropped before fetching or verifying anything,
+        new ones are fetched from announcing node and read as a message.
+        '''
+        if not self.__seen_inventory.add((kind, item_hash)):
+            return 'Already seen', OK
+
+        message, status = self.__read_inventory_item(kind, item_hash, sender_address)
+        if status != OK:
+            # item was not accepted - it can be announced again by other node
+            self.__seen_inventory.remove((kind, item_hash))
+        return message, status
 
-            response = requests.post(
-                url=f'http://{node.address}/message', json=frame)
+    def __read_inventory_item(self, kind: str, item_hash: str, sender_address: str):
+        sender_pk_hex = self.get_public_key_by_address(sender_address)
+        if sender_pk_hex is None:
+            self.__logger.warning(f'Unknown node {sender_address} announced {kind} {item_hash}')
+            return 'Unknown sender', BAD_REQUEST
+        if self.__digger is None:
+            return 'Not ready to get inventory', BAD_REQUEST
+
+        try:
+            response = self.__get_session(sender_address).get(
+                url=f'http://{sender_address}/inventory/{kind}/{item_hash}', timeout=SPREAD_TIMEOUT)
+            response.raise_for_status()
+            frame = response.json()
+        except (requests.RequestException, ValueError) as err:
+            self.__logger.warning(f'Unable to fetch {kind} {item_hash} from {sender_address}: {err}')
+            return f'Unable to fetch {kind}', BAD_REQUEST
+
+        try:
+            fetched_hash = self.__get_inventory_hash(kind, self.__message_utils.getPayload(frame))
+            if fetched_hash != item_hash:
+                self.__logger.warning(f'Node {sender_address} returned wrong {kind} for {item_hash}')
+                return f'Fetched {kind} does not match announcement', BAD_REQUEST
+            return self.read_message(frame, sender_pk_hex)
+        except Exception as err:
+            self.__logger.warning(f'Unable to read {kind} {item_hash} from {sender_address}: {err}')
+            return f'Unable to read {kind}', BAD_REQUEST
+
+    @staticmethod
+    def __get_inventory_hash(kind: str, payload: dict) -> str | None:
+        '''
+        Returns hash of block or id of transaction carried by payload of inventory item.
+        '''
+        if kind == INVENTORY_BLOCK and payload['type'] == 'new_block':
+            return Block.load(payload['block']).get_block_hash()
+        if kind == INVENTORY_TRANSACTION and payload['type'] == 'new_transaction':
+            return payload['transaction']['transaction_id']
+        return None
 
-            if not response.ok:
-                nodes_that_reject.append(node)
+    def get_inventory_body(self, kind: str, item_hash: str) -> bytes | None:
+        '''
+        Returns serialized frame of item announced by node or None if it is not available anymore.
+        Blocks from blockchain tree are returned as well - they are requested by nodes missing them.
+        '''
+        body = self.__inventory.get((kind, item_hash))
+        if body is None:
+            if kind != INVENTORY_BLOCK or self.__digger is None:
+                return None
+            block = self.__digger.get_blockchain_tree().get_block(item_hash)
+            if block is None:
+                return None
+            frame = self.__message_utils.wrap_message({
+                'type': 'new_block',
+                'block': block.to_json()
+            })
+            return json.dumps(frame).encode('utf-8')
+        return body
+
+    def request_block(self, block_hash: str) -> None:
+        '''
+        Requests block missing in blockchain tree (parent of orphan block) from known nodes.
+        Request is sent in background - called while blockchain pool is locked.
+        '''
+        if not self.__requested_blocks.add(block_hash):
+            return
+        self.__spread_executor.submit(self.__fetch_block, block_hash)
+
+    def __fetch_block(self, block_hash: str) -> None:
+        '''
+        Fetches block from the first node which has it and adds it to blockchain pool.
+        '''
+        for node in list(self.pub_list):
+            if node.address == self.__ignore_address:
+                continue
+            try:
+                response = self.__get_session(node.address).get(
+                    url=f'http://{node.address}/inventory/{INVENTORY_BLOCK}/{block_hash}', timeout=SPREAD_TIMEOUT)
+                if response.status_code == NOT_FOUND:
+                    continue
+                response.raise_for_status()
+                frame = response.json()
+                self.__message_utils.verify_message(frame, bytes.fromhex(node.public_key))
+                block = Block.load(self.__message_utils.getPayload(frame)['block'])
+            except Exception as err:
+                self.__logger.warning(f'Unable to fetch block {block_hash} from {node.address}: {err}')
+                continue
+            if block.get_block_hash() != block_hash or not block.verify_block():
+                self.__logger.warning(f'Node {node.address} returned wrong block for {block_hash}')
+                continue
+            message, _ = self.__digger.add_block(block)
+            self.__logger.info(f'Fetched missing block {block_hash} from {node.address}: {message}')
+            return
+        # block can be requested again with the next orphan
+        self.__requested_blocks.remove(block_hash)
+        self.__logger.warning(f'No node returned missing block {block_hash}')
+
+    def __get_session(self, address: str) -> requests.Session:
+        '''
+        Returns persistent session (keep-alive connection) for node address.
+        Every thread uses its own sessions.
+        '''
+        sessions = getattr(self.__thread_sessions, 'sessions', None)
+        if sessions is None:
+            sessions = {}
+            self.__thread_sessions.sessions = sessions
+        session = sessions.get(address)
+        if session is None:
+            # close connections of the thread to nodes which are not known anymore
+            addresses = set(node_info.address for node_info in self.pub_list)
+            for unknown_address in [known_address for known_address in sessions if known_address not in addresses]:
+                sessions.pop(unknown_address).close()
+            session = requests.Session()
+            sessions[address] = session
+        return session
 
     def get_digger(self):
         return self.__digger
@@ -1,14 +1,21 @@
 
 from CryptoUtils import get_order_directory_recursively, is_valid
+from CryptoOwnerTable import owner_table
 from logging import Logger
 
 
 class Output:
-    __owner: str = None
-    __amount: int = 0
+    # slots instead of instance dictionary - blockchain and transaction pool keep many outputs
+    __slots__ = ('__owner', '__amount')
+    # id of owner from owner table - or owner public key, when owner is not in the table yet.
+    # Owners are added to the table only by blocks connected to blockchain, so outputs
+    # of not verified transactions do not grow the table
+    __owner: int | str
+    __amount: int
 
     def __init__(self, owner: str, amount: int) -> None:
-        self.__owner = owner
+        owner_id = owner_table.find_id(owner)
+        self.__owner = owner if owner_id is None else owner_id
         self.__amount = amount
 
     @staticmethod
@@ -30,13 +37,37 @@ class Output:
         return Output(**data)
 
     def get_owner(self) -> str:
-        return self.__owner
+        owner = self.__owner
+        return owner if type(owner) is str else owner_table.get_owner(owner)
+
+    def get_owner_id(self) -> int | None:
+        '''
+        Returns id of owner or None if owner is not in owner table.
+        '''
+        owner = self.__owner
+        if type(owner) is int:
+            return owner
+        owner_id = owner_table.find_id(owner)
+        if owner_id is not None:
+            self.__owner = owner_id
+        return owner_id
+
+    def intern_owner(self) -> int:
+        '''
+        Returns id of owner - owner is added to owner table if it is not there yet.
+        Called only for blocks connected to blockchain.
+        '''
+        owner = self.__owner
+        if type(owner) is str:
+            owner = owner_table.get_id(owner)
+            self.__owner = owner
+        return owner
 
     def get_amount(self) -> int:
         return self.__amount
 
     def to_json(self):
         return get_order_directory_recursively({
-            'owner': self.__owner,
+            'owner': self.get_owner(),
             'amount': self.__amount
         })
@@ -0,0 +1,52 @@
+from threading import Lock
+
+
+class OwnerTable:
+    '''
+    Interning table of owner public keys.
+
+    Every public key gets a small integer id when it is seen for the first
+    time. Outputs and indexes keep ids instead of 64 characters long keys,
+    so every key is stored once and owners are compared and hashed as
+    integers. Ids are valid only inside the process - JSON, snapshots and
+    API responses use public keys.
+    '''
+    # public key -> owner id
+    __ids: dict[str, int] = None
+    # owner id -> public key
+    __owners: list[str] = None
+    __lock: Lock = None
+
+    def __init__(self) -> None:
+        self.__ids = {}
+        self.__owners = []
+        self.__lock = Lock()
+
+    def get_id(self, owner: str) -> int:
+        '''
+        Returns id of the owner, new id is assigned to owner seen for the first time.
+        '''
+        owner_id = self.__ids.get(owner)
+        if owner_id is None:
+            with self.__lock:
+                owner_id = self.__ids.get(owner)
+                if owner_id is None:
+                    owner_id = len(self.__owners)
+                    self.__owners.append(owner)
+                    self.__ids[owner] = owner_id
+        return owner_id
+
+    def find_id(self, owner: str) -> int | None:
+        '''
+        Returns id of the owner or None if owner was not seen yet.
+        '''
+        return self.__ids.get(owner)
+
+    def get_owner(self, owner_id: int) -> str:
+        return self.__owners[owner_id]
+
+    def __len__(self) -> int:
+        return len(self.__owners)
+
+
+owner_table = OwnerTable()
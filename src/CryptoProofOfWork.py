@@ -0,0 +1,147 @@
+from CryptoBlock import Block, target
+from logging import Logger
+from typing import Callable
+import hashlib
+import multiprocessing
+import queue
+
+# how often waiting miner checks whether workers are still alive (seconds)
+WORKER_CHECK_INTERVAL = 1
+# how many nonces worker tries between checks of the stop event
+STOP_CHECK_NONCES = 1024
+
+
+class ProofOfWorkEngine:
+    '''
+    Nonce search for single block template.
+
+    Proof of work data does not depend on nonce, so it is serialized and hashed
+    once. Every attempt only copies prefix hash state, adds the nonce and compares
+    raw digest with the target. Results are the same as for `Block.verify_nonce`.
+    '''
+    __prefix_hash = None
+    __target_bytes: bytes = None
+
+    def __init__(self, pow_bytes: bytes) -> None:
+        self.__prefix_hash = hashlib.sha256(pow_bytes)
+        # sha256 digest is big-endian number, so bytes compare like integers
+        self.__target_bytes = target.to_bytes(32, 'big')
+
+    @staticmethod
+    def from_block(block: Block):
+        return ProofOfWorkEngine(block.get_pow_bytes())
+
+    def verify_nonce(self, nonce: int) -> bool:
+        hash_state = self.__prefix_hash.copy()
+        hash_state.update(str(nonce).encode('utf-8'))
+        return hash_state.digest() < self.__target_bytes
+
+    def search(self, nonces: range) -> int | None:
+        '''
+        Tries nonces in given order.
+
+        :returns: First valid nonce or None if there is no valid nonce in range.
+        '''
+        copy_prefix_hash = self.__prefix_hash.copy
+        target_bytes = self.__target_bytes
+        for nonce in nonces:
+            hash_state = copy_prefix_hash()
+            hash_state.update(b'%d' % nonce)
+            if hash_state.digest() < target_bytes:
+                return nonce
+        return None
+
+
+def _w_search(pow_bytes: bytes, worker_idx: int, workers: int, max_nonce: int, stop_event, results) -> None:
+    '''
+    Worker process - tries every `workers`-th nonce starting from `worker_idx`.
+    '''
+    engine = ProofOfWorkEngine(pow_bytes)
+    batch_size = STOP_CHECK_NONCES * workers
+    for batch_start in range(worker_idx, max_nonce, batch_size):
+        if stop_event.is_set():
+            break
+        nonce = engine.search(range(batch_start, min(batch_start + batch_size, max_nonce), workers))
+        if nonce is not None:
+            results.put(nonce)
+            stop_event.set()
+            return
+    results.put(None)
+
+
+class ParallelProofOfWork:
+    '''
+    Proof of work splitted across worker processes.
+
+    Nonce range is interleaved between workers. First found solution stops
+    all workers, as well as `abort` called when chain head changes.
+    '''
+    __workers: int = None
+    __logger: Logger = None
+    # stop event of currently running proof of work
+    __stop_event = None
+
+    def __init__(self, workers: int, logger: Logger) -> None:
+        self.__workers = workers
+        self.__logger = logger
+
+    def get_workers(self) -> int:
+        return self.__workers
+
+    def abort(self) -> None:
+        '''
+        Stops all workers of currently running proof of work.
+        '''
+        stop_event = self.__stop_event
+        if stop_event is not None:
+            stop_event.set()
+
+    def run(self, block: Block, max_nonce: int, is_stale: Callable[[], bool]) -> tuple[int, bool]:
+        '''
+        Runs proof of work on all workers.
+
+        :returns: Tuple of valid nonce (if found, otherwise, max possible nonce value - 1) and bool (if nonce is valid).
+        '''
+        context = multiprocessing.get_context()
+        stop_event = context.Event()
+        results = context.Queue()
+        self.__stop_event = stop_event
+        # chain head could change before abort was able to reach this run
+        if is_stale():
+            self.__stop_event = None
+            return (0, False)
+
+        # serialized in miner process, workers do not depend on serialization mode
+        pow_bytes = block.get_pow_bytes()
+        processes = [
+            context.Process(target=_w_search,
+                            args=(pow_bytes, worker_idx, self.__workers, max_nonce, stop_event, results),
+                            daemon=True)
+            for worker_idx in range(self.__workers)
+        ]
+        for process in processes:
+            process.start()
+
+        finished_workers = 0
+        try:
+            while finished_workers < self.__workers:
+                try:
+                    nonce = results.get(timeout=WORKER_CHECK_INTERVAL)
+                except queue.Empty:
+                    if not any(process.is_alive() for process in processes):
+                        self.__logger.warning('Mining workers exited without result')
+                        break
+                    continue
+                if nonce is not None:
+                    return (nonce, True)
+                finished_workers += 1
+            # no worker found valid nonce or proof of work was aborted
+            return (max_nonce - 1, False)
+        finally:
+            self.__stop_event = None
+            stop_event.set()
+            for process in processes:
+                process.join(timeout=1)
+                if process.is_alive():
+                    self.__logger.warning('Mining worker did not stop - terminating it')
+                    process.terminate()
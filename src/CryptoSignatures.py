@@ -0,0 +1,71 @@
+from CryptoInventory import LruCache
+from concurrent.futures import ThreadPoolExecutor
+from nacl.signing import VerifyKey
+from nacl.exceptions import BadSignatureError
+import hashlib
+
+# how many verified (message digest, signature, public key) entries are remembered
+VERIFIED_SIGNATURES_SIZE = 100000
+# how many public keys are kept ready to verify
+VERIFY_KEYS_SIZE = 10000
+# signature verification releases GIL, so threads verify signatures in parallel
+VERIFY_WORKERS = 4
+# batches smaller than that are verified in calling thread
+MIN_PARALLEL_BATCH = 8
+
+
+class SignatureVerifier:
+    '''
+    Ed25519 signature verification with caches.
+
+    Only successful verifications are remembered, so the same transaction
+    checked again (when received, when packed into a block, when restored
+    after fork) costs one hash of its data instead of signature check.
+    '''
+    __verified: LruCache = None
+    __verify_keys: LruCache = None
+    __executor: ThreadPoolExecutor = None
+
+    def __init__(self, workers: int = VERIFY_WORKERS) -> None:
+        self.__verified = LruCache(VERIFIED_SIGNATURES_SIZE)
+        self.__verify_keys = LruCache(VERIFY_KEYS_SIZE)
+        self.__executor = ThreadPoolExecutor(max_workers=workers)
+
+    def get_verify_key(self, public_key: str) -> VerifyKey:
+        verify_key = self.__verify_keys.get(public_key)
+        if verify_key is None:
+            verify_key = VerifyKey(bytes.fromhex(public_key))
+            self.__verify_keys.add(public_key, verify_key)
+        return verify_key
+
+    def verify(self, public_key: str, message: bytes, signature: str) -> None:
+        '''
+        Verifies signature of message made by owner of public key.
+
+        :throws: BadSignatureError when signature is not valid, ValueError when key or signature is malformed.
+        '''
+        key = (hashlib.sha256(message).digest(), signature, public_key)
+        if key in self.__verified:
+            return
+        self.get_verify_key(public_key).verify(message, bytes.fromhex(signature))
+        self.__verified.add(key)
+
+    def is_valid(self, public_key: str, message: bytes, signature: str) -> bool:
+        try:
+            self.verify(public_key, message, signature)
+            return True
+        except (BadSignatureError, ValueError, TypeError):
+            return False
+
+    def verify_batch(self, items: list[tuple[str, bytes, str]]) -> list[bool]:
+        '''
+        Verifies many (public key, message, signature) items using worker threads.
+
+        :returns: Validity of every item, in items order.
+        '''
+        if len(items) < MIN_PARALLEL_BATCH:
+            return [self.is_valid(*item) for item in items]
+        return list(self.__executor.map(lambda item: self.is_valid(*item), items))
+
+
+signature_verifier = SignatureVerifier()
@@ -1,48 +1,59 @@
 
-from CryptoUtils import get_order_directory_recursively, is_valid
+from CryptoUtils import get_order_directory_recursively, is_valid, to_hashed_bytes
 from CryptoInput import Input
 from CryptoOutput import Output
 from logging import Logger
 from CryptoKeyManager import KeyManager
-from nacl.signing import VerifyKey
+from CryptoSignatures import signature_verifier
 from logging import Logger
-import json
 import math
 
 TRANSACTION_FEE_SHARE = 0.01
 
 class Transaction:
-    __data: dict = None
+    # slots instead of instance dictionary - blockchain and transaction pool keep many transactions
+    __slots__ = ('__transaction_id', '__transaction_fee', '__signature', '__inputs', '__outputs', '__message',
+                 '__signed_bytes', '__bytes')
+    __transaction_id: str
+    __transaction_fee: int
+    __signature: str
+    __inputs: list[Input]
+    __outputs: list[Output]
+    __message: str
+    # serialized transaction data - calculated on first use
+    __signed_bytes: bytes | None
+    __bytes: bytes | None
 
     def __init__(self, transaction_id: str, transaction_fee: int, signature: str, inputs: list[Input], outputs: list[Output], message: str):
-        self.__data = {
-            'transaction_id': transaction_id,
-            'transaction_fee': transaction_fee,
-            'signature': signature,
-            'inputs': inputs,
-            'outputs': outputs,
-            'message': message
-        }
+        self.__transaction_id = transaction_id
+        self.__transaction_fee = transaction_fee
+        self.__signature = signature
+        self.__inputs = inputs
+        self.__outputs = outputs
+        self.__message = message
+        self.__signed_bytes = None
+        self.__bytes = None
 
     def get_data_without_signature(self):
         data = {
-            'transaction_id': self.__data['transaction_id'],
-            'transaction_fee': self.__data['transaction_fee'],
-            'inputs': [input.to_json() for input in self.__data['inputs']],
-            'outputs': [output.to_json() for output in self.__data['outputs']],
-            'message': self.__data['message']
+            'transaction_id': self.__transaction_id,
+            'transaction_fee': self.__transaction_fee,
+            'inputs': [input.to_json() for input in self.__inputs],
+            'outputs': [output.to_json() for output in self.__outputs],
+            'message': self.__message
         }
         data = get_order_directory_recursively(data)
         return data
 
     def get_transaction_fee(self):
-        return int(self.__data['transaction_fee'])
+        return int(self.__transaction_fee)
 
     def get_signature(self):
-        return self.__data['signature']
+        return self.__signature
 
     def set_signature(self, signature):
-        self.__data['signature'] = signature
+        self.__signature = signature
+        self.__bytes = None
         
     def is_consistent(self) -> tuple[str, bool]:
         '''
@@ -109,15 +120,26 @@ class Transaction:
             return 'Sum of inputs should be equal to sum of outputs + transaction fee', False
         
         # Check if inputs are only once on list
-        used_inputs_json_str_list = []
+        # input with output index is identified by its outpoint, input without it
+        # points to any output of source transaction with its amount
+        used_outpoints = set()
+        # (source transaction id, amount) of inputs with and without output index
+        indexed_amounts = set()
+        legacy_amounts = set()
         for input in inputs:
             # Only block price blocks can be the same.
             if input.is_block_price():
                 continue
-            input_json_str = str(input.to_json())
-            if input_json_str in used_inputs_json_str_list:
+            amount_key = (input.get_transaction_id(), input.get_amount())
+            if input.get_output_index() is None:
+                if amount_key in legacy_amounts or amount_key in indexed_amounts:
+                    return "Inputs are multiple times in input list", False
+                legacy_amounts.add(amount_key)
+                continue
+            if input.get_outpoint() in used_outpoints or amount_key in legacy_amounts:
                 return "Inputs are multiple times in input list", False
-            used_inputs_json_str_list.append(input_json_str)
+            used_outpoints.add(input.get_outpoint())
+            indexed_amounts.add(amount_key)
   
         return "Ok", True
         
@@ -178,19 +200,22 @@ class Transaction:
 
     def to_json(self):
         return get_order_directory_recursively({
-            **self.__data,
-            'inputs': [input.to_json() for input in self.__data['inputs']],
-            'outputs': [output.to_json() for output in self.__data['outputs']]
+            'transaction_id': self.__transaction_id,
+            'transaction_fee': self.__transaction_fee,
+            'signature': self.__signature,
+            'inputs': [input.to_json() for input in self.__inputs],
+            'outputs': [output.to_json() for output in self.__outputs],
+            'message': self.__message
         })
 
     def get_inputs(self) -> list[Input]:
-        return self.__data['inputs']
+        return self.__inputs
 
     def get_outputs(self) -> list[Output]:
-        return self.__data['outputs']
+        return self.__outputs
 
     def get_transaction_id(self) -> str:
-        return self.__data['transaction_id']
+        return self.__transaction_id
     
     def get_sender(self) -> str | None:
         input_owners = [input.get_owner() for input in self.get_inputs()]
@@ -239,7 +264,7 @@ class Transaction:
                                   signature=None, inputs=inputs, outputs=outputs, message=message)
         data = transaction.get_data_without_signature()
 
-        signature = key_manager.sign(json.dumps(data).encode('utf-8'))
+        signature = key_manager.sign(transaction.get_signed_bytes())
         # add signature to data
         data = {**data, 'signature': signature}
         message, is_valid = Transaction.is_valid(data, logger)
@@ -250,15 +275,38 @@ class Transaction:
         transaction.set_signature(signature)
         return transaction, message, True
     
+    def get_signed_bytes(self) -> bytes:
+        '''
+        Returns transaction data covered by signature.
+        '''
+        if self.__signed_bytes is None:
+            self.__signed_bytes = to_hashed_bytes(self.get_data_without_signature())
+        return self.__signed_bytes
+
+    def get_bytes(self) -> bytes:
+        '''
+        Returns serialized transaction with signature.
+        '''
+        if self.__bytes is None:
+            self.__bytes = to_hashed_bytes(self.to_json())
+        return self.__bytes
+
     def verifyTransactionSignature(self):
         '''
         Throws erro if signature not valid
         '''
-        transaction_owner_pub_key = self.get_sender()
-        transaction_json_bytes = json.dumps(self.get_data_without_signature()).encode('utf-8')
-        signature = bytes.fromhex(self.get_signature())
-
-        transaction_owner_pub_key_bytes = bytes.fromhex(transaction_owner_pub_key)
-        verify_key = VerifyKey(transaction_owner_pub_key_bytes)
         # throw error if signature is invalid
-        verify_key.verify(transaction_json_bytes, signature)
+        signature_verifier.verify(self.get_sender(), self.get_signed_bytes(), self.get_signature())
+
+    @staticmethod
+    def verify_signatures(transactions: list) -> list[bool]:
+        '''
+        Verifies signatures of many transactions in parallel.
+        Verified signatures are cached, so following `is_consistent` calls do not verify them again.
+
+        :returns: Validity of every transaction signature, in transactions order.
+        '''
+        return signature_verifier.verify_batch([
+            (transaction.get_sender(), transaction.get_signed_bytes(), transaction.get_signature())
+            for transaction in transactions
+        ])
@@ -1,53 +1,160 @@
-
 from CryptoTransaction import Transaction
+from collections import deque
+from threading import Lock
+import heapq
+import time
+
+# memory budget for pending transactions (bytes of serialized transactions)
+MAX_POOL_SIZE = 5000000
+# pending transaction is dropped after this time (seconds)
+TRANSACTION_EXPIRY = 3600
 
 
 class TransactionPool:
-    _transactions: list[Transaction] = None
-
-    def __init__(self):
-        self._transactions = []
-
-    def add_transaction(self, transaction: Transaction):
-        self._transactions.insert(0, transaction)
-
-    def get_next_transaction_json(self, lost_transactions: list[Transaction], applied_tranaction_ids = list[str]) -> dict | None:
-        transaction = self.get_next_transaction(lost_transactions, applied_tranaction_ids)
-        if transaction is not None:
-            return transaction.to_json()
-        return None
-
-    def get_next_transaction(self, lost_transactions: list[Transaction], applied_tranaction_ids = list[str]) -> Transaction | None:
-        next_transaction = None
-        # Get transaction from transaction list
-        while len(self._transactions) != 0:
-            transaction = self._transactions[-1]
-            if transaction.get_transaction_id() in applied_tranaction_ids:
-                self._transactions.pop()
-                continue
-            next_transaction = transaction
-            break
-        if next_transaction is not None:
-            return next_transaction
-        
-        # Get lost transaction
-        if len(lost_transactions) > 0:
-            next_transaction = lost_transactions[0]
-            return next_transaction
-        
-        return None
-            
-
-    def pop_next_transaction(self):
-        if len(self._transactions) == 0:
-            return
-        return self._transactions.pop()
+    '''
+    Pending transactions ordered by transaction fee per byte.
+
+    Transactions are indexed by transaction id. Two heaps keep the best and the
+    worst transaction on top, removed transactions are skipped lazily when they
+    reach the top of the heap. When memory budget is exceeded transactions with
+    the lowest fee are evicted.
+    Pool is used by request handlers and mining thread, every public method
+    works under the pool lock.
+    '''
+    # transaction id -> (transaction, size, fee per byte, added at, sequence number)
+    _transactions: dict[str, tuple[Transaction, int, float, float, int]] = None
+    # (-fee per byte, sequence number, transaction id) - best transaction on top
+    __best_heap: list[tuple[float, int, str]] = None
+    # (fee per byte, -sequence number, transaction id) - worst transaction on top
+    __worst_heap: list[tuple[float, int, str]] = None
+    # (added at, sequence number, transaction id) in order of adding
+    __expiry_queue: deque = None
+    __size: int = None
+    __sequence: int = None
+    __max_size: int = None
+    __expiry: float = None
+    __lock: Lock = None
+
+    def __init__(self, max_size: int = MAX_POOL_SIZE, expiry: float = TRANSACTION_EXPIRY):
+        self._transactions = {}
+        self.__best_heap = []
+        self.__worst_heap = []
+        self.__expiry_queue = deque()
+        self.__size = 0
+        self.__sequence = 0
+        self.__max_size = max_size
+        self.__expiry = expiry
+        self.__lock = Lock()
+
+    def add_transaction(self, transaction: Transaction) -> tuple[str, bool]:
+        with self.__lock:
+            self.__remove_expired()
+            transaction_id = transaction.get_transaction_id()
+            if transaction_id in self._transactions:
+                return 'Transaction already in transaction pool', False
+
+            size = len(transaction.get_bytes())
+            fee_per_byte = transaction.get_transaction_fee() / size
+            if size > self.__max_size:
+                return 'Transaction exceeds transaction pool size', False
+            # make room for new transaction by evicting cheaper ones
+            while self.__size + size > self.__max_size:
+                worst_fee_per_byte, _, worst_transaction_id = self.__peek(self.__worst_heap)
+                if worst_fee_per_byte >= fee_per_byte:
+                    return 'Transaction pool is full', False
+                self.__remove(worst_transaction_id)
+
+            sequence = self.__sequence
+            self.__sequence += 1
+            added_at = time.monotonic()
+            self._transactions[transaction_id] = (transaction, size, fee_per_byte, added_at, sequence)
+            heapq.heappush(self.__best_heap, (-fee_per_byte, sequence, transaction_id))
+            heapq.heappush(self.__worst_heap, (fee_per_byte, -sequence, transaction_id))
+            self.__expiry_queue.append((added_at, sequence, transaction_id))
+            self.__size += size
+            return 'Ok', True
+
+    def get_transaction(self, transaction_id: str) -> Transaction | None:
+        with self.__lock:
+            entry = self._transactions.get(transaction_id)
+            if entry is None:
+                return None
+            return entry[0]
+
+    def get_transactions(self, applied_tranaction_ids: set[str], limit: int | None = None) -> list[Transaction]:
+        '''
+        Returns pending transactions from the highest fee per byte.
+        Transactions already applied in blockchain are removed from the pool.
+        '''
+        with self.__lock:
+            self.__remove_expired()
+            transactions = []
+            popped_items = []
+            while len(self.__best_heap) > 0 and (limit is None or len(transactions) < limit):
+                item = heapq.heappop(self.__best_heap)
+                transaction_id = item[2]
+                if not self.__is_current(transaction_id, item[1]):
+                    continue
+                if transaction_id in applied_tranaction_ids:
+                    self.__remove(transaction_id)
+                    continue
+                popped_items.append(item)
+                transactions.append(self._transactions[transaction_id][0])
+            for item in popped_items:
+                heapq.heappush(self.__best_heap, item)
+            return transactions
+
+    def remove_transactions(self, transaction_ids: set[str]) -> None:
+        with self.__lock:
+            for transaction_id in transaction_ids:
+                if transaction_id in self._transactions:
+                    self.__remove(transaction_id)
+
+    def __remove(self, transaction_id: str) -> None:
+        _, size, _, _, _ = self._transactions.pop(transaction_id)
+        self.__size -= size
+        # drop heap items of removed transactions when there are too many of them
+        if len(self.__best_heap) > 2 * len(self._transactions) + 64:
+            self.__compact()
+
+    def __remove_expired(self) -> None:
+        expire_before = time.monotonic() - self.__expiry
+        while len(self.__expiry_queue) > 0 and self.__expiry_queue[0][0] < expire_before:
+            _, sequence, transaction_id = self.__expiry_queue.popleft()
+            if self.__is_current(transaction_id, sequence):
+                self.__remove(transaction_id)
+
+    def __is_current(self, transaction_id: str, sequence: int) -> bool:
+        '''
+        Checks if heap item still points to transaction present in the pool.
+        '''
+        entry = self._transactions.get(transaction_id)
+        return entry is not None and abs(sequence) == entry[4]
+
+    def __peek(self, heap: list[tuple[float, int, str]]) -> tuple[float, int, str]:
+        while not self.__is_current(heap[0][2], heap[0][1]):
+            heapq.heappop(heap)
+        return heap[0]
+
+    def __compact(self) -> None:
+        self.__best_heap = [item for item in self.__best_heap if self.__is_current(item[2], item[1])]
+        self.__worst_heap = [item for item in self.__worst_heap if self.__is_current(item[2], item[1])]
+        heapq.heapify(self.__best_heap)
+        heapq.heapify(self.__worst_heap)
+        self.__expiry_queue = deque(
+            item for item in self.__expiry_queue if self.__is_current(item[2], item[1]))
 
     def to_json(self):
         json_data = {}
-        for i in range(len(self._transactions)):
-            json_data[f"transaction_{str(i + 1)}"] = self._transactions[i].to_json()
+        transactions = self.get_transactions(set())
+        for i in range(len(transactions)):
+            json_data[f"transaction_{str(i + 1)}"] = transactions[i].to_json()
         return json_data
-    
+
     def count(self):
-        return len(self._transactions)
+        with self.__lock:
+            return len(self._transactions)
+
+    def get_size(self) -> int:
+        with self.__lock:
+            return self.__size
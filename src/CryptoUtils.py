@@ -1,4 +1,50 @@
 import nacl.secret
+import json
+
+# encoding of blocks and transactions used for hashes and signatures:
+# legacy - the same bytes as before canonical encoding, so existing blockchains stay valid
+# canonical - JSON with sorted keys, without whitespace, UTF-8
+SERIALIZATION_LEGACY = 'legacy'
+SERIALIZATION_CANONICAL = 'canonical'
+SERIALIZATION_MODES = (SERIALIZATION_LEGACY, SERIALIZATION_CANONICAL)
+# all nodes of the network have to use the same mode - set it before any block or transaction is created
+_serialization_mode = SERIALIZATION_LEGACY
+# legacy encodings - blocks and proof of work data were hashed as python representation,
+# transactions and messages were signed as JSON
+LEGACY_JSON = 'json'
+LEGACY_REPR = 'repr'
+
+
+def get_serialization_mode() -> str:
+    return _serialization_mode
+
+
+def set_serialization_mode(mode: str) -> None:
+    global _serialization_mode
+    if mode not in SERIALIZATION_MODES:
+        raise ValueError(f'Unknown serialization mode {mode}')
+    _serialization_mode = mode
+
+
+def to_canonical_bytes(value) -> bytes:
+    '''
+    Encodes JSON-like value deterministically - equal values give equal bytes.
+    '''
+    return json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def to_hashed_bytes(value, legacy_encoding: str = LEGACY_JSON) -> bytes:
+    '''
+    Encodes value which is hashed or signed - all hashes and signatures use this function.
+
+    Canonical mode encodes every value with `to_canonical_bytes`. Legacy mode keeps
+    encoding the value had before canonical mode was introduced.
+    '''
+    if _serialization_mode == SERIALIZATION_CANONICAL:
+        return to_canonical_bytes(value)
+    if legacy_encoding == LEGACY_REPR:
+        return str(value).encode('utf-8')
+    return json.dumps(value).encode('utf-8')
 
 
 def get_order_directory_recursively(directory: dict):
@@ -0,0 +1,283 @@
+from threading import RLock
+from CryptoBlock import Block
+from CryptoInput import Input, BLOCK_PRICE_ID, BLOCK_PRICE_AMOUNT
+from CryptoOwnerTable import owner_table
+from logging import Logger
+
+
+class UtxoIndex:
+    '''
+    Unspent outputs of the main blockchain.
+
+    Outputs are kept per owner and keyed by outpoint - source transaction id
+    and output index - so looking up inputs of one owner does not need to walk
+    the whole chain and every output of a transaction can be spent separately.
+    Blocks are connected in chain order and disconnected in reverse order.
+    Owners are kept as owner table ids, snapshots use public keys.
+    Index is shared by mining thread and request handlers, so it is read and
+    updated under its own lock.
+    '''
+
+    # owner id -> source transaction id -> output index -> input ready to spend
+    __sources: dict[int, dict[str, dict[int, Input]]] = None
+    # owner id -> number of blocks mined by owner
+    __mined_blocks: dict[int, int] = None
+    # owner id -> number of block mining prices used in inputs
+    __spent_block_prices: dict[int, int] = None
+    # (block hash, undo operations) for every connected block
+    __undo_records: list[tuple[str, list[tuple]]] = None
+    __lock: RLock = None
+
+    def __init__(self) -> None:
+        self.__sources = {}
+        self.__mined_blocks = {}
+        self.__spent_block_prices = {}
+        self.__undo_records = []
+        self.__lock = RLock()
+
+    def get_length(self) -> int:
+        return len(self.__undo_records)
+
+    def get_block_hash(self, height: int) -> str:
+        return self.__undo_records[height][0]
+
+    def get_spent_inputs(self, height: int) -> list[Input]:
+        '''
+        Returns outputs spent by block at height - taken from its undo record.
+        '''
+        with self.__lock:
+            return [operation[3] for operation in self.__undo_records[height][1] if operation[0] == 'spent']
+
+    def connect_block(self, block: Block, block_hash: str | None = None) -> None:
+        '''
+        Applies block transactions on top of the index.
+        '''
+        with self.__lock:
+            if block_hash is None:
+                block_hash = block.get_block_hash()
+            undo = []
+            # owners are added to owner table only by connected blocks
+            miner = owner_table.get_id(block.get_miner())
+            self.__mined_blocks[miner] = self.__mined_blocks.get(miner, 0) + 1
+            undo.append(('mined', miner))
+
+            for transaction in block.get_transactions():
+                # remove from sources used outputs
+                for input in transaction.get_inputs():
+                    owner = input.intern_owner()
+                    source_transaction_id = input.get_transaction_id()
+                    if source_transaction_id == BLOCK_PRICE_ID:
+                        self.__spent_block_prices[owner] = self.__spent_block_prices.get(owner, 0) + 1
+                        undo.append(('block_price', owner))
+                        continue
+                    spent_input = self.find_input(input)
+                    if spent_input is None:
+                        continue
+                    self.__remove_source(owner, spent_input)
+                    undo.append(('spent', owner, source_transaction_id, spent_input))
+                # add to sources outputs from block
+                transaction_id = transaction.get_transaction_id()
+                for output_index, output in enumerate(transaction.get_outputs()):
+                    owner = output.intern_owner()
+                    outputs = self.__sources.setdefault(owner, {}).setdefault(transaction_id, {})
+                    if output_index in outputs:
+                        # transaction id should be unique
+                        continue
+                    outputs[output_index] = Input(transaction_id=transaction_id, owner=output.get_owner(),
+                                                  amount=output.get_amount(), output_index=output_index)
+                    undo.append(('created', owner, transaction_id, output_index))
+
+            self.__undo_records.append((block_hash, undo))
+
+    def disconnect_block(self) -> str | None:
+        '''
+        Reverts the last connected block.
+
+        :returns: Hash of disconnected block or None if index is empty.
+        '''
+        with self.__lock:
+            if len(self.__undo_records) == 0:
+                return None
+            block_hash, undo = self.__undo_records.pop()
+            for operation in reversed(undo):
+                kind, owner = operation[0], operation[1]
+                if kind == 'mined':
+                    UtxoIndex.__decrement(self.__mined_blocks, owner)
+                elif kind == 'block_price':
+                    UtxoIndex.__decrement(self.__spent_block_prices, owner)
+                elif kind == 'spent':
+                    spent_input = operation[3]
+                    self.__sources.setdefault(owner, {}).setdefault(operation[2], {})[spent_input.get_output_index()] = spent_input
+                elif kind == 'created':
+                    self.__remove_source(owner, self.__sources[owner][operation[2]][operation[3]])
+            return block_hash
+
+    def find_input(self, input: Input) -> Input | None:
+        '''
+        Returns unspent output pointed by input (with its output index) or None if it is not available.
+
+        Input without output index points to output of source transaction
+        owned by input owner with the same amount.
+        '''
+        with self.__lock:
+            owner_sources = self.__sources.get(input.get_owner_id())
+            if owner_sources is None:
+                return None
+            outputs = owner_sources.get(input.get_transaction_id())
+            if outputs is None:
+                return None
+            output_index = input.get_output_index()
+            if output_index is not None:
+                source = outputs.get(output_index)
+                if source is None or source.get_amount() != input.get_amount():
+                    return None
+                return source
+            for source in outputs.values():
+                if source.get_amount() == input.get_amount():
+                    return source
+            return None
+
+    def find_unavailable_input(self, inputs: list[Input]) -> Input | None:
+        '''
+        Returns the first input which cannot be spent or None if all inputs are available.
+
+        Inputs are checked at once, so blocks connected in the meantime do not
+        change the result. Every output and block mining price can be used once.
+        '''
+        with self.__lock:
+            # outpoints of unspent outputs used by inputs - inputs with and without
+            # output index can point to the same output
+            used_outpoints = set()
+            used_block_prices = 0
+            for input in inputs:
+                if input.is_block_price():
+                    used_block_prices += 1
+                    if input.get_amount() != BLOCK_PRICE_AMOUNT or \
+                            self.get_block_prices_count(input.get_owner()) < used_block_prices:
+                        return input
+                    continue
+                source = self.find_input(input)
+                if source is None or source.get_outpoint() in used_outpoints:
+                    return input
+                used_outpoints.add(source.get_outpoint())
+            return None
+
+    def __remove_source(self, owner: int, source: Input) -> None:
+        # empty buckets are dropped - index is the same as built from scratch for the same chain
+        owner_sources = self.__sources[owner]
+        outputs = owner_sources[source.get_transaction_id()]
+        del outputs[source.get_output_index()]
+        if len(outputs) == 0:
+            del owner_sources[source.get_transaction_id()]
+            if len(owner_sources) == 0:
+                del self.__sources[owner]
+
+    @staticmethod
+    def __decrement(counters: dict[int, int], owner: int) -> None:
+        count = counters[owner] - 1
+        if count > 0:
+            counters[owner] = count
+        else:
+            del counters[owner]
+
+    def to_snapshot(self) -> dict:
+        '''
+        Returns index state as JSON-serializable dictionary.
+        '''
+        with self.__lock:
+            undo_records = []
+            for block_hash, undo in self.__undo_records:
+                operations = []
+                for operation in undo:
+                    operation = [operation[0], owner_table.get_owner(operation[1]), *operation[2:]]
+                    if operation[0] == 'spent':
+                        # spent input is restored from its amount and output index
+                        spent_input = operation[3]
+                        operation[3:] = [spent_input.get_amount(), spent_input.get_output_index()]
+                    operations.append(operation)
+                undo_records.append([block_hash, operations])
+            return {
+                # owner -> [source transaction id, output index, amount]
+                'sources': {
+                    owner_table.get_owner(owner): [
+                        [transaction_id, output_index, input.get_amount()]
+                        for transaction_id, outputs in owner_sources.items()
+                        for output_index, input in outputs.items()
+                    ]
+                    for owner, owner_sources in self.__sources.items()
+                },
+                'mined_blocks': {owner_table.get_owner(owner): count for owner, count in self.__mined_blocks.items()},
+                'spent_block_prices': {
+                    owner_table.get_owner(owner): count for owner, count in self.__spent_block_prices.items()
+                },
+                'undo_records': undo_records
+            }
+
+    @staticmethod
+    def from_snapshot(snapshot: dict):
+        '''
+        Restores index saved with `to_snapshot`.
+        '''
+        utxo_index = UtxoIndex()
+        utxo_index.__sources = {}
+        for owner, sources in snapshot['sources'].items():
+            owner_sources = utxo_index.__sources.setdefault(owner_table.get_id(owner), {})
+            for transaction_id, output_index, amount in sources:
+                owner_sources.setdefault(transaction_id, {})[output_index] = Input(
+                    transaction_id=transaction_id, owner=owner, amount=amount, output_index=output_index)
+        utxo_index.__mined_blocks = {
+            owner_table.get_id(owner): count for owner, count in snapshot['mined_blocks'].items()
+        }
+        utxo_index.__spent_block_prices = {
+            owner_table.get_id(owner): count for owner, count in snapshot['spent_block_prices'].items()
+        }
+        for block_hash, operations in snapshot['undo_records']:
+            undo = []
+            for operation in operations:
+                if operation[0] == 'spent':
+                    _, owner, transaction_id, amount, output_index = operation
+                    operation = ('spent', owner, transaction_id,
+                                 Input(transaction_id=transaction_id, owner=owner, amount=amount, output_index=output_index))
+                undo.append((operation[0], owner_table.get_id(operation[1]), *operation[2:]))
+            utxo_index.__undo_records.append((block_hash, undo))
+        return utxo_index
+
+    def sync(self, blocks: list[Block]) -> None:
+        '''
+        Moves index to the state of provided blockchain blocks.
+        Only blocks after the fork point are disconnected and connected.
+        '''
+        with self.__lock:
+            height = min(len(blocks), self.get_length())
+            # equal block hashes mean equal chains up to that block
+            while height > 0 and self.get_block_hash(height - 1) != blocks[height - 1].get_block_hash():
+                height -= 1
+            while self.get_length() > height:
+                self.disconnect_block()
+            for block in blocks[height:]:
+                self.connect_block(block)
+
+    def get_block_prices_count(self, target_owner: str) -> int:
+        '''
+        Returns number of block mining prices owner can still use.
+        '''
+        with self.__lock:
+            owner = owner_table.find_id(target_owner)
+            return self.__mined_blocks.get(owner, 0) - self.__spent_block_prices.get(owner, 0)
+
+    def get_inputs(self, target_owner: str, logger: Logger | None = None) -> list[Input]:
+        '''
+        Return valid inputs for target owner.
+        '''
+        with self.__lock:
+            owner = owner_table.find_id(target_owner)
+            inputs = [input for outputs in self.__sources.get(owner, {}).values() for input in outputs.values()]
+            mined_blocks = self.__mined_blocks.get(owner, 0) - \
+                self.__spent_block_prices.get(owner, 0)
+            if logger:
+                logger.info(
+                    f'Found {len(inputs)} unspent outputs and {max(mined_blocks, 0)} block mining prices')
+            for _ in range(mined_blocks):
+                inputs.append(Input(transaction_id=BLOCK_PRICE_ID,
+                                    owner=target_owner, amount=BLOCK_PRICE_AMOUNT))
+            return inputs
@@ -1,12 +1,15 @@
 from CryptoNodeInfo import NodeInfo
-from flask import Flask, request, render_template
+from flask import Flask, request, render_template, Response
 import os
 from logging.config import dictConfig
 
 import requests
-from CryptoNode import Node, OK, BAD_REQUEST
+from CryptoNode import Node, OK, BAD_REQUEST, NOT_FOUND, JSON_CONTENT_TYPE
 import json
 from CryptoTransaction import Transaction
+from CryptoBlock import Block
+from CryptoInventory import INVENTORY_KINDS
+from CryptoUtils import set_serialization_mode, SERIALIZATION_LEGACY
 import random
 
 dictConfig({
@@ -45,16 +48,38 @@ def fetch_probability_value_from_env_vars(var_name):
         raise ValueError(f"Provided '{var_name}' value is out of allowed range. It must be value between [0, 1]")
     return env_var_value
 
+def fetch_mining_workers_from_env_vars(var_name):
+    env_var_value = os.environ.get(var_name, None)
+    if env_var_value is None:
+        return 1
+    try:
+        env_var_value = int(env_var_value)
+    except Exception:
+        raise ValueError(f"Provided '{var_name}' parameter must be integer number - correct it and try again")
+    if env_var_value < 0:
+        raise ValueError(f"Provided '{var_name}' value can not be negative. Use 0 to mine on all available cores")
+    if env_var_value == 0:
+        env_var_value = os.cpu_count() or 1
+    return env_var_value
+
 # fetch block accept probability from environment variables
 BLOCK_ACCEPT_PROBABILITY = fetch_probability_value_from_env_vars("CANDIDATE_BLOCK_ACCEPT_CHANCE")
 # fetch transaction accept probability from environment variables
 TRANSACTION_RECEIVE_CHANCE = fetch_probability_value_from_env_vars("TRANSACTION_ACCEPT_CHANCE")
+# fetch number of proof of work processes from environment variables
+MINING_WORKERS = fetch_mining_workers_from_env_vars("MINING_WORKERS")
+# encoding of blocks and transactions used for hashes and signatures - the same for all nodes
+try:
+    set_serialization_mode(os.environ.get("SERIALIZATION_MODE", SERIALIZATION_LEGACY))
+except ValueError as err:
+    raise ValueError(f"Provided 'SERIALIZATION_MODE' parameter is not valid - correct it and try again: {err}")
 
 node = Node(reference_address,
             secret_key, app,
             ignore_address=ignore_address,
             block_accept_probability=BLOCK_ACCEPT_PROBABILITY,
-            transaction_process_chance=TRANSACTION_RECEIVE_CHANCE)
+            transaction_process_chance=TRANSACTION_RECEIVE_CHANCE,
+            mining_workers=MINING_WORKERS)
 print(node.pub_list)
 
 app.node = node
@@ -79,15 +104,50 @@ def get_nodes():
     return pub_list
 
 
+BLOCKS_PAGE_ARGS = ('locator', 'from_hash', 'from_height', 'to_height', 'limit')
+
+
 @app.route('/blocks')
 def get_blocks():
-    blocks = None
-    if node.get_digger() is not None:
-        blocks = [block.to_json() for block in node.get_digger().get_all_blocks()]
-
-    if blocks is None:
+    if node.get_digger() is None:
         return [], 500
-    return blocks
+
+    if any(arg in request.args for arg in BLOCKS_PAGE_ARGS):
+        # page of main blockchain
+        try:
+            from_height, to_height, limit = [
+                int(request.args[arg]) if arg in request.args else None
+                for arg in ('from_height', 'to_height', 'limit')
+            ]
+        except ValueError:
+            return 'Heights and limit should be integers', BAD_REQUEST
+        locator = request.args.get('locator')
+        if locator is not None:
+            locator = [block_hash for block_hash in locator.split(',') if block_hash != '']
+        page, status = node.get_blocks_page(locator=locator, from_hash=request.args.get('from_hash'),
+                                            from_height=from_height, to_height=to_height, limit=limit)
+        if status != OK:
+            return page, status
+        blocks = page.pop('blocks')
+    else:
+        page = None
+        blocks = node.get_digger().get_all_blocks()
+
+    # blocks are serialized one by one while response is sent
+    return Response(iter_blocks_json(blocks, page), mimetype=JSON_CONTENT_TYPE)
+
+
+def iter_blocks_json(blocks: list[Block], page: dict | None):
+    '''
+    Yields JSON list of blocks (or page object with such list) block by block.
+    '''
+    if page is None:
+        yield '['
+    else:
+        yield json.dumps(page)[:-1] + ', "blocks": ['
+    for idx, block in enumerate(blocks):
+        yield (', ' if idx > 0 else '') + json.dumps(block.to_json())
+    yield ']' if page is None else ']}'
 
 
 @app.route('/public-key')
@@ -279,13 +339,30 @@ def read_message():
     request_addr = f"{request.remote_addr}:5000"
     object = request.get_json()
 
-
     sender_pkey_hex = node.get_public_key_by_address(request_addr)
 
     message, status = node.read_message(object, sender_pkey_hex)
     return message, status
 
 
+@app.route("/inventory/<kind>/<item_hash>", methods=["POST"])
+def read_inventory(kind, item_hash):
+    # announcement has no body - duplicates are dropped without parsing anything
+    if kind not in INVENTORY_KINDS:
+        return 'Unknown inventory kind', BAD_REQUEST
+    request_addr = f"{request.remote_addr}:5000"
+    message, status = node.read_inventory(kind, item_hash, request_addr)
+    return message, status
+
+
+@app.route("/inventory/<kind>/<item_hash>", methods=["GET"])
+def get_inventory(kind, item_hash):
+    body = node.get_inventory_body(kind, item_hash)
+    if body is None:
+        return 'Unknown inventory item', NOT_FOUND
+    return Response(body, mimetype=JSON_CONTENT_TYPE)
+
+
 @app.route("/last-block-hash", methods=["GET"])
 def last_block_hash():
     return node.blockchain._blocks[-1].get_block_hash()